@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+
+ANSWER_CACHE_SIZE = 512
+ANSWER_CACHE_TTL = 24 * 60 * 60
+ANSWER_CACHE_DIR = os.environ.get("ANSWER_CACHE_DIR")
+
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_question(question: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a question"""
+    return _SPACE_RE.sub(' ', question.lower()).strip().rstrip('?.! ')
+
+
+def answer_key(doc_key: str, question: str, backend: str, model: str, **settings: Any) -> str:
+    """
+    Cache key of an answer
+
+    Args:
+        doc_key: Content hash of the document
+        question: The question as asked
+        backend: Answering backend (e.g. 'huggingface', 'ollama')
+        model: Model name
+        settings: Anything else that changes the answer, such as retrieval settings
+    """
+    payload = json.dumps(
+        [doc_key, normalize_question(question), backend, model, sorted(settings.items())],
+        default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """
+    In-process LRU cache of answers with expiry and an optional on-disk tier.
+
+    The memory tier is an OrderedDict in least-recently-used order, guarded by
+    a lock so it can be shared by every session of the app. With disk_dir set,
+    answers are also written as JSON files (atomically, via os.replace) so they
+    survive restarts and are shared between processes; disk hits are promoted
+    to memory.
+
+    Args:
+        max_entries: Answers kept in memory
+        ttl: Seconds an answer stays valid
+        disk_dir: Directory of the on-disk tier (None to disable it)
+    """
+
+    def __init__(self, max_entries: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 disk_dir: Optional[str] = ANSWER_CACHE_DIR):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key + ".json")
+
+    def _read_disk(self, key: str) -> Optional[Tuple[float, Dict]]:
+        if not self.disk_dir:
+            return None
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if record['expires'] <= time.time():
+            self._remove_disk(key)
+            return None
+        return record['expires'], record['value']
+
+    def _write_disk(self, key: str, expires: float, value: Dict) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding='utf-8') as f:
+                json.dump({'expires': expires, 'value': value}, f)
+            os.replace(tmp_path, self._path(key))
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Could not write answer cache entry: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _remove_disk(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+        entry = self._read_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._store(key, entry)
+            self.hits += 1
+        return entry[1]
+
+    def _store(self, key: str, entry: Tuple[float, Dict]) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key: str, value: Dict) -> None:
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._store(key, (expires, value))
+        if self.disk_dir:
+            self._write_disk(key, expires, value)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_dir:
+            self._remove_disk(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
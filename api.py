@@ -0,0 +1,296 @@
+"""
+HTTP inference service for the research assistant.
+
+Run with e.g. ``uvicorn api:app --workers 2``. Every worker process warms up
+its models once at startup (API_PRELOAD_MODELS, comma separated registry
+names; empty to load models on first use) and keeps processed documents in memory and in the shared on-disk
+index store, so clients refer to an upload by its document id.
+Model work runs in the threadpool, off the event loop, and concurrent QA
+requests are micro-batched (QA_MICRO_BATCHING=0 turns that off).
+POST /library/ask answers from every uploaded document at once, citing the
+document and span of the answer; documents already in the index store are
+opened into the library at startup (API_LOAD_LIBRARY=0 turns that off).
+GET /metrics exposes per-stage latency histograms of the worker for Prometheus.
+"""
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+import os
+import threading
+from fastapi import BackgroundTasks, FastAPI, File, HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from utils import extract_text_with_offsets, NamedBytesIO
+from summarizer import generate_summary
+from question_answering import ask_question, set_qa_scheduler
+from qa_scheduler import QABatchScheduler
+from challenge_mode import generate_questions, evaluate_answers, QUESTION_COUNT
+from question_bank import QuestionBank
+from chunking import ChunkIndex
+from retrieval import RETRIEVERS, TOP_K, MIN_SCORE
+from index_store import IndexStore, content_hash
+from model_registry import registry, QA_MODEL
+from ollama_qa import OllamaQA
+from ollama_client import get_client
+from document import Document
+from library import DocumentLibrary, ask_library
+from tracing import span, tracer
+
+PRELOAD_MODELS = [name for name in os.environ.get("API_PRELOAD_MODELS", "qa").split(",") if name]
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3:instruct")
+# Seconds /challenge waits for the question bank before generating synchronously
+CHALLENGE_WAIT = 60
+MICRO_BATCHING = os.environ.get("QA_MICRO_BATCHING", "1") == "1"
+LOAD_LIBRARY = os.environ.get("API_LOAD_LIBRARY", "1") == "1"
+
+class AskRequest(BaseModel):
+    question: str
+    backend: str = 'auto'
+    retrieval: str = 'bm25'
+    top_k: int = TOP_K
+    min_score: float = MIN_SCORE
+
+
+class LibraryAskRequest(BaseModel):
+    question: str
+    document_ids: Optional[List[str]] = None
+    backend: str = 'auto'
+    top_k: int = TOP_K
+    min_score: float = MIN_SCORE
+
+
+class GradeRequest(BaseModel):
+    questions: List[Dict]
+    answers: List[str]
+
+
+class DocumentStore:
+    """Processed documents of this worker, backed by the shared IndexStore"""
+
+    def __init__(self, cache: Optional[IndexStore] = None):
+        self.cache = cache or IndexStore()
+        self._documents: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        # Every document of the worker, searched together by /library/ask
+        self.library = DocumentLibrary()
+
+    def add(self, name: str, data: bytes) -> str:
+        doc_id = content_hash(data)
+        if self.get(doc_id) is None:
+            with span("upload.extract"):
+                text, offsets = extract_text_with_offsets(NamedBytesIO(data, name))
+            with span("upload.chunking"):
+                chunk_index = ChunkIndex(text)
+            document = {'name': name, 'text': text, 'chunk_index': chunk_index, 'offsets': offsets,
+                        'summary': "", 'retrievers': {}}
+            with self._lock:
+                self._documents[doc_id] = document
+            self.cache.put(doc_id, document)
+        self.question_bank(doc_id)
+        self.add_to_library(doc_id)
+        return doc_id
+
+    def add_to_library(self, doc_id: str) -> None:
+        """Add a document to the library, reusing its BM25 index"""
+        if doc_id in self.library:
+            return
+        document = self.require(doc_id)
+        self.library.add(
+            Document(document['text'], doc_id, document['chunk_index'], document.get('offsets')),
+            document.get('name') or doc_id,
+            retriever=self.retriever(doc_id, 'bm25')
+        )
+
+    def load_library(self) -> None:
+        """Open every stored document that has a BM25 index into the library"""
+        for doc_id in self.cache.keys():
+            document = self.get(doc_id)
+            if document is not None and 'bm25' in document['retrievers']:
+                self.add_to_library(doc_id)
+
+    def get(self, doc_id: str) -> Optional[Dict]:
+        with self._lock:
+            document = self._documents.get(doc_id)
+        if document is None:
+            document = self.cache.get(doc_id)
+            if document is not None:
+                with self._lock:
+                    document = self._documents.setdefault(doc_id, document)
+        return document
+
+    def require(self, doc_id: str) -> Dict:
+        document = self.get(doc_id)
+        if document is None:
+            raise HTTPException(status_code=404, detail=f"Unknown document: {doc_id}")
+        return document
+
+    def summary(self, doc_id: str) -> str:
+        document = self.require(doc_id)
+        if not document['summary']:
+            with span("upload.summary"):
+                document['summary'] = generate_summary(document['text'], doc_key=doc_id)
+            self.cache.put(doc_id, document)
+        return document['summary']
+
+    def question_bank(self, doc_id: str, retrieval: str = 'bm25') -> QuestionBank:
+        """The document's challenge question bank, refilled in the background"""
+        document = self.require(doc_id)
+        bank = document.get('question_bank')
+        if bank is None:
+            bank = document['question_bank'] = QuestionBank(len(document['chunk_index']))
+        bank.fill(document['chunk_index'], self.retriever(doc_id, retrieval))
+        return bank
+
+    def retriever(self, doc_id: str, method: str):
+        if method not in RETRIEVERS:
+            raise HTTPException(status_code=400, detail=f"Unknown retrieval method: {method}")
+        document = self.require(doc_id)
+        if method not in document['retrievers']:
+            with span(f"upload.index.{method}"):
+                document['retrievers'][method] = RETRIEVERS[method](document['chunk_index'])
+            self.cache.put(doc_id, document)
+        return document['retrievers'][method]
+
+
+store = DocumentStore()
+ollama_qa: Optional[OllamaQA] = None
+qa_scheduler: Optional[QABatchScheduler] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up this worker's models and Ollama connection before serving"""
+    global ollama_qa, qa_scheduler
+    if PRELOAD_MODELS:
+        # preload() with no names would load every model
+        await run_in_threadpool(registry.preload, *PRELOAD_MODELS)
+    if LOAD_LIBRARY:
+        with span("startup.library"):
+            await run_in_threadpool(store.load_library)
+    client = get_client()
+    if await client.ais_available():
+        ollama_qa = OllamaQA(model_name=OLLAMA_MODEL, client=client, rag=True)
+    if MICRO_BATCHING:
+        # Concurrent /ask requests share forward passes of the QA model
+        qa_scheduler = QABatchScheduler()
+        set_qa_scheduler(qa_scheduler)
+    yield
+    if qa_scheduler is not None:
+        set_qa_scheduler(None)
+        qa_scheduler.close()
+
+
+app = FastAPI(title="GenAI Research Assistant API", lifespan=lifespan)
+
+
+@app.get("/health")
+async def health() -> Dict:
+    return {
+        'status': 'ok',
+        'ollama': ollama_qa is not None,
+        # Model answering /ask with the default backend, e.g. for answer cache keys
+        'qa_model': ollama_qa.model_name if ollama_qa is not None else f"{QA_MODEL}@{registry.stats()['qa']['backend']}",
+        'models': registry.stats(),
+        'qa_scheduler': qa_scheduler.metrics() if qa_scheduler is not None else None
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> str:
+    """Per-stage latency histograms in the Prometheus text format"""
+    return tracer.prometheus_text()
+
+
+@app.post("/documents")
+async def upload_document(file: UploadFile = File(...), include_text: bool = False) -> Dict:
+    data = await file.read()
+    try:
+        doc_id = await run_in_threadpool(store.add, file.filename or "", data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await get_document(doc_id, include_text)
+
+
+@app.get("/documents/{doc_id}")
+async def get_document(doc_id: str, include_text: bool = False) -> Dict:
+    document = await run_in_threadpool(store.require, doc_id)
+    info = {
+        'document_id': doc_id,
+        'word_count': document['chunk_index'].word_count,
+        'characters': len(document['text']),
+        'has_summary': bool(document['summary']),
+        'question_bank': document['question_bank'].status() if document.get('question_bank') else None
+    }
+    if include_text:
+        info['text'] = document['text']
+    return info
+
+
+@app.post("/documents/{doc_id}/summary")
+async def summarize_document(doc_id: str) -> Dict:
+    return {'summary': await run_in_threadpool(store.summary, doc_id)}
+
+
+@app.post("/documents/{doc_id}/ask")
+async def ask_document(doc_id: str, request: AskRequest) -> Dict:
+    document = await run_in_threadpool(store.require, doc_id)
+    retriever = await run_in_threadpool(store.retriever, doc_id, request.retrieval)
+    use_ollama = request.backend == 'ollama' or (request.backend == 'auto' and ollama_qa is not None)
+    if use_ollama:
+        if ollama_qa is None:
+            raise HTTPException(status_code=503, detail="Ollama is not available")
+        return await run_in_threadpool(
+            ollama_qa.ask_question, document['text'], request.question,
+            retriever=retriever, top_k=request.top_k, min_score=request.min_score
+        )
+    return await run_in_threadpool(
+        ask_question, document['text'], request.question,
+        index=document['chunk_index'], retriever=retriever,
+        top_k=request.top_k, min_score=request.min_score, offsets=document.get('offsets')
+    )
+
+
+@app.post("/documents/{doc_id}/challenge")
+async def challenge_document(doc_id: str, background_tasks: BackgroundTasks,
+                             retrieval: str = 'bm25') -> List[Dict]:
+    document = await run_in_threadpool(store.require, doc_id)
+    retriever = await run_in_threadpool(store.retriever, doc_id, retrieval)
+    bank = await run_in_threadpool(store.question_bank, doc_id, retrieval)
+    questions = await run_in_threadpool(
+        bank.draw, QUESTION_COUNT, document['chunk_index'], retriever, CHALLENGE_WAIT
+    )
+    if questions:
+        # Only the bank changed: persist it after the response is sent
+        background_tasks.add_task(store.cache.put_question_bank, doc_id, bank)
+        return questions
+    return await run_in_threadpool(
+        generate_questions, document['text'], index=document['chunk_index'], retriever=retriever
+    )
+
+
+@app.get("/library")
+async def list_library() -> List[Dict]:
+    return store.library.stats()
+
+
+@app.post("/library/ask")
+async def ask_library_documents(request: LibraryAskRequest) -> Dict:
+    """Answer from the documents of the library (or only request.document_ids)"""
+    for doc_id in request.document_ids or []:
+        await run_in_threadpool(store.add_to_library, doc_id)
+    use_ollama = request.backend == 'ollama' or (request.backend == 'auto' and ollama_qa is not None)
+    if use_ollama and ollama_qa is None:
+        raise HTTPException(status_code=503, detail="Ollama is not available")
+    return await run_in_threadpool(
+        ask_library, store.library, request.question, top_k=request.top_k,
+        min_score=request.min_score, ollama=ollama_qa if use_ollama else None,
+        keys=set(request.document_ids) if request.document_ids else None
+    )
+
+
+@app.post("/challenge/grade")
+async def grade_answers(request: GradeRequest) -> List[Dict]:
+    """Grade answers to questions from /challenge, in one batch"""
+    if len(request.questions) != len(request.answers):
+        raise HTTPException(status_code=400, detail="Expected one answer per question")
+    return await run_in_threadpool(evaluate_answers, request.questions, request.answers)
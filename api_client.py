@@ -0,0 +1,52 @@
+from typing import Dict, List, Optional
+import os
+import requests
+
+API_URL = os.environ.get("RESEARCH_API_URL", "")
+
+
+class ResearchAPIClient:
+    """
+    Thin client for the inference service in api.py
+
+    Args:
+        base_url: URL of the service (e.g. 'http://localhost:8000')
+        timeout: Seconds to wait for a response; summaries of long documents can take minutes
+    """
+
+    def __init__(self, base_url: str = API_URL, timeout: float = 600):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def _post(self, path: str, **kwargs) -> requests.Response:
+        response = self.session.post(f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def health(self) -> Dict:
+        """Status of the service and the models it answers with"""
+        response = self.session.get(f"{self.base_url}/health", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def upload(self, name: str, data: bytes) -> Dict:
+        """Upload a document; returns its id, statistics and text"""
+        return self._post(
+            "/documents",
+            files={'file': (name, data)},
+            params={'include_text': True}
+        ).json()
+
+    def summary(self, doc_id: str) -> str:
+        return self._post(f"/documents/{doc_id}/summary").json()['summary']
+
+    def ask(self, doc_id: str, question: str, **settings) -> Dict:
+        return self._post(f"/documents/{doc_id}/ask", json={'question': question, **settings}).json()
+
+    def ask_library(self, question: str, document_ids: Optional[List[str]] = None, **settings) -> Dict:
+        """Ask across uploaded documents; the answer cites the document it comes from"""
+        return self._post("/library/ask", json={'question': question, 'document_ids': document_ids, **settings}).json()
+
+    def challenge(self, doc_id: str, retrieval: str = 'bm25') -> List[Dict]:
+        return self._post(f"/documents/{doc_id}/challenge", params={'retrieval': retrieval}).json()
@@ -1,50 +1,341 @@
 import streamlit as st
-import time
+import requests
 from typing import Dict, List, Tuple, Optional
-from utils import extract_text_from_file
-from summarizer import generate_summary
 from question_answering import ask_question as default_ask_question, highlight_text
-from challenge_mode import generate_questions, evaluate_answer
+from chunking import ChunkIndex
+from document import Document
+from retrieval import RETRIEVERS, TOP_K, MIN_SCORE
+from index_store import IndexStore, content_hash
+from model_registry import registry, QA_MODEL
+from answer_cache import AnswerCache, answer_key
+from challenge_mode import generate_questions, evaluate_answers, QUESTION_COUNT
+from question_bank import QuestionBank
+from jobs import document_job, summary_job, DONE, FAILED, RUNNING, SKIPPED
+from library import DocumentLibrary, ask_library
+from utils import extract_text_with_offsets, page_label
 from ollama_qa import OllamaQA
+from ollama_client import OllamaError, get_client
+from api_client import ResearchAPIClient, API_URL
+from tracing import span, tracer
 import os
 import json
-import time
 
 USE_OLLAMA = False
 qa_model = None
 
-try:
-    import requests
-    response = requests.get('http://localhost:11434/api/tags', timeout=5)
-    if response.status_code == 200:
+api = ResearchAPIClient(API_URL) if API_URL else None
+
+if api is not None:
+    print(f"Using inference service at {API_URL}")
+else:
+    ollama_client = get_client()
+    if ollama_client.is_available():
         print("Ollama is running!")
         try:
-            qa_model = OllamaQA(model_name="llama3:instruct")
+            if not any(name.startswith("llama3:instruct") for name in ollama_client.list_models()):
+                print("Pulling llama3:instruct model...")
+                ollama_client.pull("llama3:instruct")
+            qa_model = OllamaQA(model_name="llama3:instruct", client=ollama_client, rag=True)
             print(" Successfully connected to Ollama with llama3:instruct model")
             USE_OLLAMA = True
-        except Exception as e:
+        except OllamaError as e:
             print(f" Could not load model: {e}")
-            print("Trying to pull the model...")
-            import subprocess
-            try:
-                subprocess.run(["ollama", "pull", "llama3:instruct"], check=True)
-                qa_model = OllamaQA(model_name="llama3:instruct")
-                print(" Successfully pulled and loaded llama3:instruct model")
-                USE_OLLAMA = True
-            except Exception as pull_error:
-                print(f" Failed to pull model: {pull_error}")
-                USE_OLLAMA = False
-except Exception as e:
-    print(f" Could not connect to Ollama: {e}")
-    print("Please make sure Ollama is installed and running")
-    print("You can download it from: https://ollama.ai/download")
-    print("Falling back to default Hugging Face model...")
-
-def ask_question(document_text: str, question: str) -> Dict:
+            USE_OLLAMA = False
+    else:
+        print(f" Could not connect to Ollama at {ollama_client.host}")
+        print("Please make sure Ollama is installed and running")
+        print("You can download it from: https://ollama.ai/download")
+        print("Falling back to default Hugging Face model...")
+
+def ask_question(document_text: str, question: str, index: Optional[ChunkIndex] = None,
+                 retriever=None, top_k: int = TOP_K, min_score: float = MIN_SCORE,
+                 offsets=None) -> Dict:
     """Wrapper function to use either Ollama or default QA model"""
     if USE_OLLAMA:
-        return qa_model.ask_question(document_text, question)
-    return default_ask_question(document_text, question)
+        return qa_model.ask_question(document_text, question, retriever=retriever,
+                                     top_k=top_k, min_score=min_score)
+    return default_ask_question(document_text, question, index=index, retriever=retriever,
+                                top_k=top_k, min_score=min_score, offsets=offsets)
+
+# Labels of the retrieval methods -> their keys in retrieval.RETRIEVERS, which
+# the API and the shared index store use too
+RETRIEVAL_METHODS = {
+    "Keyword (BM25)": "bm25",
+    "Semantic (embeddings)": "embeddings"
+}
+
+@st.cache_resource
+def get_document_cache() -> IndexStore:
+    return IndexStore()
+
+@st.cache_resource
+def get_answer_cache() -> AnswerCache:
+    return AnswerCache()
+
+@st.cache_data(ttl=60)
+def api_qa_model() -> str:
+    """Model the inference service answers questions with"""
+    return api.health()['qa_model']
+
+def api_error_result(error: requests.RequestException) -> Dict:
+    """A failed call to the inference service as an answer, like the errors of local answering"""
+    detail = str(error)
+    if error.response is not None:
+        try:
+            detail = error.response.json().get('detail', detail)
+        except ValueError:
+            pass
+    return {
+        'answer': f"Error getting a response from the inference service: {detail}",
+        'confidence': 0,
+        'context': "",
+        'highlight': "",
+        'error': True
+    }
+
+def cache_document():
+    """Store the processed document of this session in the shared index store"""
+    document = st.session_state.document
+    if document is not None:
+        get_document_cache().put(document.key, {
+            'text': document.text,
+            'chunk_index': document.index,
+            'offsets': document.offsets,
+            'summary': st.session_state.summary,
+            'retrievers': st.session_state.retrievers,
+            'question_bank': st.session_state.question_bank
+        })
+
+def start_question_bank(retriever, bank: Optional[QuestionBank] = None):
+    """Fill the challenge question bank of the current document in the background"""
+    index = st.session_state.document.index
+    if bank is None or bank.chunk_count != len(index):
+        bank = QuestionBank(len(index))
+    st.session_state.question_bank = bank
+    bank.fill(index, retriever)
+
+def get_retriever(method: str):
+    """Retrieval index of the current document, built on first use per method"""
+    if st.session_state.document is None:
+        return None
+    if method not in st.session_state.retrievers:
+        job = st.session_state.job
+        if job is not None and method == st.session_state.job_method:
+            # Being built by the processing job; search without an index until then
+            return None
+        with span("upload.index"):
+            st.session_state.retrievers[method] = RETRIEVERS[method](st.session_state.document.index)
+        if st.session_state.summary:
+            cache_document()
+    return st.session_state.retrievers[method]
+
+JOB_STAGE_LABELS = {
+    'extract': "Extracting text",
+    'chunking': "Splitting into sections",
+    'index': "Building the search index",
+    'questions': "Preparing challenge questions",
+    'summary': "Summarizing"
+}
+JOB_STATE_ICONS = {DONE: "✅", RUNNING: "⏳", FAILED: "❌", SKIPPED: "⏭️"}
+
+def sync_job() -> bool:
+    """Move results of finished processing stages into the session; True if anything changed"""
+    job = st.session_state.job
+    if job is None:
+        return False
+    changed = False
+    if st.session_state.document is None and job.ready('chunking'):
+        st.session_state.document = job.result('chunking')
+        changed = True
+    if job.ready('index') and st.session_state.job_method not in st.session_state.retrievers:
+        st.session_state.retrievers[st.session_state.job_method] = job.result('index')
+        changed = True
+    if st.session_state.question_bank is None and job.ready('questions'):
+        st.session_state.question_bank = job.result('questions')
+        changed = True
+    if not st.session_state.summary and job.ready('summary'):
+        st.session_state.summary = job.result('summary')
+        changed = True
+    if job.finished:
+        status = job.status()
+        errors = [f"{JOB_STAGE_LABELS[name]}: {s['error']}" for name, s in status.items() if s['state'] == FAILED]
+        st.session_state.job_error = errors[0] if errors else None
+        # Stages that failed are left out; a missing index is rebuilt on first use
+        # and a missing summary when the document is next opened
+        cache_document()
+        st.session_state.last_trace = ("Document processing", [
+            (f"upload.{name}", s['seconds']) for name, s in status.items() if s['seconds'] is not None
+        ])
+        st.session_state.job = None
+        changed = True
+    return changed
+
+@st.fragment(run_every=1.0)
+def processing_status():
+    """Live status of the background processing stages; reruns the page as results arrive"""
+    job = st.session_state.job
+    if job is None:
+        return
+    if sync_job():
+        st.rerun()
+    for name, status in job.status().items():
+        line = f"{JOB_STATE_ICONS.get(status['state'], '▫️')} {JOB_STAGE_LABELS[name]}"
+        if status['seconds'] is not None:
+            line += f" ({status['seconds']:.1f} s)"
+        st.markdown(line)
+        if status['state'] == RUNNING and status['progress'] is not None:
+            st.progress(status['progress'])
+
+def compact_result(result: Dict) -> Dict:
+    """An answer without the text that render_answer can slice from the document by span"""
+    if 'citations' in result:
+        # Spans of library answers refer to other documents
+        return result
+    if result.get('context_span') or result.get('is_comprehensive'):
+        return {k: v for k, v in result.items() if k not in ('context', 'full_context', 'highlight')}
+    return result
+
+def compact_question(question: Dict) -> Dict:
+    """A challenge question with its context kept as a span of the document"""
+    if 'context_start' in question:
+        return {k: v for k, v in question.items() if k != 'context'}
+    return question
+
+def question_context(question: Dict) -> str:
+    if 'context' in question:
+        return question['context']
+    return st.session_state.document.slice((question['context_start'], question['context_end']))
+
+def marked_span(document: Document, span: Tuple[int, int], highlight: Tuple[int, int]) -> str:
+    """The text of span with highlight marked up"""
+    start, end = span
+    hl_start, hl_end = max(start, highlight[0]), min(end, highlight[1])
+    if hl_start >= hl_end:
+        return document.slice(span)
+    return (document.slice((start, hl_start)) +
+            f'<span class="highlight">{document.slice((hl_start, hl_end))}</span>' +
+            document.slice((hl_end, end)))
+
+def render_citations(citations: List[Dict]) -> str:
+    """HTML list of the library documents and spans an answer was drawn from"""
+    items = "".join(
+        f"<li><strong>{c['name']}</strong>, characters {c['start']:,}–{c['end']:,}: {c['excerpt']}</li>"
+        for c in citations
+    )
+    return f"""
+    <details style="margin-top: 1em; border: 1px solid #e0e0e0; border-radius: 4px; padding: 0.5em;">
+        <summary style="font-weight: bold; cursor: pointer; padding: 0.5em; color: var(--primary);">
+            Sources ({len(citations)} passages)
+        </summary>
+        <ul style="font-size: 0.9em; line-height: 1.5;">{items}</ul>
+    </details>
+    """
+
+def render_answer(result: Dict, document: Optional[Document] = None) -> str:
+    """HTML of an answer in the chat"""
+    if 'citations' in result:
+        # A library answer: its spans are in the cited documents, not the current one
+        document = None
+    is_comprehensive = result.get('is_comprehensive', False)
+    
+    if is_comprehensive:
+        response = f"""
+        <div style="margin-bottom: 1em;">
+            <div style="font-weight: bold; margin-bottom: 0.5em; color: var(--primary);">Answer:</div>
+            <div style="margin-bottom: 1em; white-space: pre-line; line-height: 1.6;">{result['answer']}</div>
+        """
+        
+        if result.get('sources') and document is not None:
+            excerpts = "".join(
+                f"<li>Characters {start:,}–{end:,}"
+                f"{' (' + page_label(document.pages((start, end))) + ')' if document.offsets is not None else ''}: "
+                f"{document.slice((start, min(end, start + 200)))}...</li>"
+                for start, end in result['sources']
+            )
+            response += f"""
+            <details style="margin-top: 1em; border: 1px solid #e0e0e0; border-radius: 4px; padding: 0.5em;">
+                <summary style="font-weight: bold; cursor: pointer; padding: 0.5em; color: var(--primary);">
+                    Context used ({len(result['sources'])} passages)
+                </summary>
+                <ul style="font-size: 0.9em; line-height: 1.5;">{excerpts}</ul>
+            </details>
+            """
+        
+        response += "</div>"
+    else:
+        if result['confidence'] > 70:
+            confidence_class = "confidence-high"
+        elif result['confidence'] > 30:
+            confidence_class = "confidence-medium"
+        else:
+            confidence_class = "confidence-low"
+        
+        response = f"""
+        <div style="margin-bottom: 1em;">
+            <div style="font-weight: bold; margin-bottom: 0.5em; color: var(--primary);">Answer:</div>
+            <div style="margin-bottom: 1em; line-height: 1.6;">{result['answer']}</div>
+            
+            <div style="display: flex; align-items: center; margin-bottom: 1em;">
+                <div style="font-weight: bold; margin-right: 0.5em;">Confidence:</div>
+                <span class="{confidence_class}">{result['confidence']}%</span>
+            </div>
+        """
+        
+        if result.get('pages'):
+            response += f"""
+            <div style="font-size: 0.9em; margin-bottom: 1em;">Found on {page_label(result['pages'])}</div>
+            """
+        
+        if result.get('cached'):
+            response += """
+            <div style="font-size: 0.8em; opacity: 0.7; margin-bottom: 1em;">Answered from cache</div>
+            """
+        elif result.get('timings'):
+            timings = result['timings']
+            response += f"""
+            <div style="font-size: 0.8em; opacity: 0.7; margin-bottom: 1em;">
+                Retrieval: {timings['retrieval'] * 1000:.0f} ms · Inference: {timings['inference'] * 1000:.0f} ms
+            </div>
+            """
+        
+        context = result.get('context')
+        if result.get('context_span') and document is not None:
+            context = marked_span(document, result['context_span'], result['answer_span'])
+        if context:
+            response += f"""
+            <details style="margin-top: 1em; border: 1px solid #e0e0e0; border-radius: 4px; padding: 0.5em;">
+                <summary style="font-weight: bold; cursor: pointer; padding: 0.5em; color: var(--primary);">
+                    View Source Context
+                </summary>
+                <div style="
+                    background: #f8f9fa;
+                    border-left: 4px solid var(--accent);
+                    padding: 0.5em 1em;
+                    margin: 0.5em 0;
+                    border-radius: 0 4px 4px 0;
+                    white-space: pre-wrap;
+                    font-size: 0.9em;
+                    line-height: 1.5;
+                ">
+                    {context}
+                </div>
+            </details>
+            """
+        
+        response += "</div>"
+    
+    if result.get('source'):
+        source = result['source']
+        location = page_label(source.get('pages', [])) or f"characters {source['start']:,}–{source['end']:,}"
+        response += f"""
+        <div style="font-size: 0.9em; margin-bottom: 0.5em;">
+            Source: <strong>{source['name']}</strong>, {location}
+        </div>
+        """
+    if result.get('citations'):
+        response += render_citations(result['citations'])
+    
+    return response
 
 # Set page config with new theme
 st.set_page_config(
@@ -270,8 +561,10 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Initialize session state (keep existing code)
-if 'document_text' not in st.session_state:
-    st.session_state.document_text = ""
+if 'document' not in st.session_state:
+    st.session_state.document = None
+if 'retrievers' not in st.session_state:
+    st.session_state.retrievers = {}
 if 'summary' not in st.session_state:
     st.session_state.summary = ""
 if 'questions' not in st.session_state:
@@ -284,6 +577,24 @@ if 'show_results' not in st.session_state:
     st.session_state.show_results = False
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if 'last_trace' not in st.session_state:
+    st.session_state.last_trace = None
+if 'question_bank' not in st.session_state:
+    st.session_state.question_bank = None
+if 'job' not in st.session_state:
+    st.session_state.job = None
+if 'job_method' not in st.session_state:
+    st.session_state.job_method = None
+if 'library' not in st.session_state:
+    st.session_state.library = DocumentLibrary()
+if 'library_ids' not in st.session_state:
+    # Uploaded file name -> id of its document in the library
+    st.session_state.library_ids = {}
+if 'job_error' not in st.session_state:
+    st.session_state.job_error = None
+if 'job_upload' not in st.session_state:
+    # (name, size) of the upload the last processing job was started for
+    st.session_state.job_upload = None
 
 # App title and description with new header
 st.markdown("""
@@ -314,6 +625,19 @@ with st.sidebar:
         label_visibility="collapsed"
     )
     
+    st.markdown("### 📚 Library")
+    library_files = st.file_uploader(
+        "Add documents to the library",
+        type=["pdf", "txt"],
+        accept_multiple_files=True,
+        key="library_files",
+        help="Each document is indexed once; questions can then be asked across all of them"
+    )
+    ask_whole_library = st.checkbox(
+        "Ask across the library", value=False,
+        help="Search every library document and cite the one the answer comes from"
+    )
+    
     st.markdown("---")
     st.markdown("### About")
     st.markdown("""
@@ -323,36 +647,153 @@ with st.sidebar:
     - Test your understanding
     """)
     
+    st.markdown("---")
+    st.markdown("### Retrieval")
+    retrieval_method = RETRIEVAL_METHODS[st.selectbox("Retrieval method", list(RETRIEVAL_METHODS))]
+    top_k = st.slider("Chunks to search per question", 1, 10, TOP_K,
+                      help="Only the best-matching chunks are passed to the QA model")
+    min_score = st.number_input("Minimum retrieval score", min_value=0.0, value=MIN_SCORE, step=0.1)
+    
+    use_answer_cache = st.checkbox("Reuse cached answers", value=True,
+                                   help="Answer repeated questions about the same document instantly; "
+                                        "when off, answers are neither read from nor saved to the cache")
+    answer_stats = get_answer_cache().stats()
+    st.caption(f"Answer cache: {answer_stats['hits']} hits, {answer_stats['misses']} misses")
+    
     st.markdown("---")
     st.markdown("### Model Status")
-    if USE_OLLAMA:
+    if api is not None:
+        st.success(f"Using inference service at {API_URL}")
+    elif USE_OLLAMA:
         st.success("Using Ollama (llama3:instruct)")
     else:
         st.info("Using default Hugging Face model")
+    
+    with st.expander("Loaded models"):
+        for name, stats in registry.stats().items():
+            if stats['loaded']:
+                st.markdown(f"**{name}** ({stats['backend']}): {stats['memory_bytes'] / 1024 ** 2:,.0f} MB, "
+                            f"loaded in {stats['load_time']:.1f} s")
+            else:
+                st.markdown(f"**{name}** ({stats['backend']}): not loaded")
+        col1, col2 = st.columns(2)
+        with col1:
+            if st.button("Preload", key="preload_models"):
+                with st.spinner("Loading models..."):
+                    registry.preload()
+                st.rerun()
+        with col2:
+            if st.button("Unload", key="unload_models"):
+                registry.unload()
+                st.rerun()
 
 # Document processing (keep existing functionality)
-if uploaded_file and not st.session_state.document_text:
-    with st.spinner(" Processing your document..."):
+sync_job()
+upload = (uploaded_file.name, uploaded_file.size) if uploaded_file else None
+if st.session_state.job_error and upload != st.session_state.job_upload:
+    # A failed document is retried once it is uploaded again or another file is
+    st.session_state.job_error = None
+if (uploaded_file and st.session_state.document is None
+        and st.session_state.job is None and st.session_state.job_error is None):
+    with st.spinner(" Processing your document..."), tracer.trace() as trace:
         try:
-            st.session_state.document_text = extract_text_from_file(uploaded_file)
-            st.session_state.summary = generate_summary(st.session_state.document_text)
+            cached = None
+            if api is None:
+                doc_key = content_hash(uploaded_file.getvalue())
+                cached = get_document_cache().get(doc_key)
+            if api is not None:
+                uploaded = api.upload(uploaded_file.name, uploaded_file.getvalue())
+                st.session_state.document = Document(uploaded['text'], uploaded['document_id'])
+                st.session_state.retrievers = {}
+                st.session_state.question_bank = None
+                st.session_state.summary = api.summary(st.session_state.document.key)
+            elif cached:
+                st.session_state.document = Document(cached['text'], doc_key, cached['chunk_index'],
+                                                     cached.get('offsets'))
+                st.session_state.retrievers = cached['retrievers']
+                st.session_state.summary = cached.get('summary') or ""
+                start_question_bank(get_retriever(retrieval_method), cached.get('question_bank'))
+                if not st.session_state.summary:
+                    # Stored without one (e.g. by the API, which summarizes on request)
+                    st.session_state.job_method = None
+                    st.session_state.job_upload = upload
+                    st.session_state.job = summary_job(st.session_state.document)
+            else:
+                # Runs on the shared job pool; sync_job picks up each stage as it
+                # finishes, so Ask mode is available once the text is extracted
+                st.session_state.retrievers = {}
+                st.session_state.question_bank = None
+                st.session_state.summary = ""
+                st.session_state.job_method = retrieval_method
+                st.session_state.job_upload = upload
+                st.session_state.job = document_job(
+                    uploaded_file.name,
+                    uploaded_file.getvalue(),
+                    doc_key,
+                    RETRIEVERS[retrieval_method]
+                )
             st.session_state.questions = []
             st.session_state.user_answers = {}
             st.session_state.show_questions = False
             st.session_state.show_results = False
             
-            st.success("Document processed successfully!")
+            if st.session_state.job is None:
+                st.success("Document processed successfully!")
+                st.session_state.last_trace = ("Document processing", trace)
         except Exception as e:
             st.error(f"Error processing document: {str(e)}")
 
+def add_library_files(files) -> None:
+    """Index uploaded files into the library (kept by the inference service if there is one)"""
+    library = st.session_state.library
+    for file in files:
+        if api is not None:
+            st.session_state.library_ids[file.name] = api.upload(file.name, file.getvalue())['document_id']
+            continue
+        doc_key = content_hash(file.getvalue())
+        st.session_state.library_ids[file.name] = doc_key
+        if doc_key in library:
+            continue
+        with span("library.add"):
+            cached = get_document_cache().get(doc_key)
+            if cached:
+                document = Document(cached['text'], doc_key, cached['chunk_index'], cached.get('offsets'))
+                retriever = cached['retrievers'].get('bm25')
+            else:
+                text, offsets = extract_text_with_offsets(file)
+                document = Document(text, doc_key, offsets=offsets)
+                retriever = None
+            library.add(document, file.name, retriever=retriever)
+
+# Files removed from the uploader leave the library
+library_names = {f.name for f in library_files or []}
+for name in [n for n in st.session_state.library_ids if n not in library_names]:
+    doc_key = st.session_state.library_ids.pop(name)
+    if doc_key not in st.session_state.library_ids.values():
+        st.session_state.library.remove(doc_key)
+new_library_files = [f for f in library_files or [] if f.name not in st.session_state.library_ids]
+if new_library_files:
+    with st.spinner("Indexing library documents..."), tracer.trace() as trace:
+        try:
+            add_library_files(new_library_files)
+            st.session_state.last_trace = ("Library indexing", trace)
+        except Exception as e:
+            st.error(f"Error adding documents to the library: {str(e)}")
+
+if st.session_state.job is not None:
+    with st.expander("Processing", expanded=True):
+        processing_status()
+if st.session_state.job_error:
+    st.error(f"Error processing document: {st.session_state.job_error}")
+
 # Document information card
-if st.session_state.document_text:
+if st.session_state.document is not None:
     with st.expander("Document Information", expanded=True):
         col1, col2 = st.columns(2)
         with col1:
-            st.metric("Word Count", f"{len(st.session_state.document_text.split()):,}")
+            st.metric("Word Count", f"{st.session_state.document.word_count:,}")
         with col2:
-            st.metric("Characters", f"{len(st.session_state.document_text):,}")
+            st.metric("Characters", f"{len(st.session_state.document):,}")
     
     # Summary section with enhanced styling
     with st.expander("Summary (≤ 250 words)", expanded=True):
@@ -364,7 +805,7 @@ if st.session_state.document_text:
             border-left: 4px solid var(--accent);
                     color: #000000; 
         ">
-            {st.session_state.summary}
+            {st.session_state.summary or ("<em>The summary is being generated...</em>" if st.session_state.job else "")}
         </div>
         """, unsafe_allow_html=True)
 
@@ -397,7 +838,10 @@ st.markdown('<h2 class="section-header">Ask Anything About the Document</h2>', u
 # Display chat messages from history
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
-        st.markdown(message["content"], unsafe_allow_html=True)
+        if "result" in message:
+            st.markdown(render_answer(message["result"], st.session_state.document), unsafe_allow_html=True)
+        else:
+            st.markdown(message["content"], unsafe_allow_html=True)
 
 # Chat input with enhanced styling
 if prompt := st.chat_input("Ask a question about the document..."):
@@ -406,88 +850,169 @@ if prompt := st.chat_input("Ask a question about the document..."):
     with st.chat_message("user"):
         st.markdown(prompt)
     
-    with st.chat_message("assistant"):
+    with st.chat_message("assistant"), tracer.trace() as trace:
         message_placeholder = st.empty()
-        full_response = ""
+        document = st.session_state.document or Document("")
+        use_library = ask_whole_library and bool(st.session_state.library_ids)
         
-        with st.spinner("Analyzing document..."):
-            result = ask_question(st.session_state.document_text, prompt)
-            is_comprehensive = result.get('is_comprehensive', False)
-            
-            if is_comprehensive:
-                response = f"""
-                <div style="margin-bottom: 1em;">
-                    <div style="font-weight: bold; margin-bottom: 0.5em; color: var(--primary);">Answer:</div>
-                    <div style="margin-bottom: 1em; white-space: pre-line; line-height: 1.6;">{result['answer']}</div>
-                </div>
-                """
-            else:
-                if result['confidence'] > 70:
-                    confidence_class = "confidence-high"
-                elif result['confidence'] > 30:
-                    confidence_class = "confidence-medium"
+        if use_library:
+            with st.spinner("Searching the library..."):
+                if api is not None:
+                    try:
+                        result = api.ask_library(
+                            prompt,
+                            list(st.session_state.library_ids.values()),
+                            top_k=top_k,
+                            min_score=min_score
+                        )
+                    except requests.RequestException as e:
+                        result = api_error_result(e)
                 else:
-                    confidence_class = "confidence-low"
-                
-                response = f"""
-                <div style="margin-bottom: 1em;">
-                    <div style="font-weight: bold; margin-bottom: 0.5em; color: var(--primary);">Answer:</div>
-                    <div style="margin-bottom: 1em; line-height: 1.6;">{result['answer']}</div>
-                    
-                    <div style="display: flex; align-items: center; margin-bottom: 1em;">
-                        <div style="font-weight: bold; margin-right: 0.5em;">Confidence:</div>
-                        <span class="{confidence_class}">{result['confidence']}%</span>
-                    </div>
-                """
-                
-                if result.get('context'):
-                    response += f"""
-                    <details style="margin-top: 1em; border: 1px solid #e0e0e0; border-radius: 4px; padding: 0.5em;">
-                        <summary style="font-weight: bold; cursor: pointer; padding: 0.5em; color: var(--primary);">
-                            View Source Context
-                        </summary>
-                        <div style="
-                            background: #f8f9fa;
-                            border-left: 4px solid var(--accent);
-                            padding: 0.5em 1em;
-                            margin: 0.5em 0;
-                            border-radius: 0 4px 4px 0;
-                            white-space: pre-wrap;
-                            font-size: 0.9em;
-                            line-height: 1.5;
-                        ">
-                            {result['context']}
-                        </div>
-                    </details>
-                    """
-                
-                response += "</div>"
-            
-            for chunk in response.split():
-                full_response += chunk + " "
-                time.sleep(0.05)
-                message_placeholder.markdown(full_response + "▌", unsafe_allow_html=True)
-            
-            message_placeholder.markdown(full_response, unsafe_allow_html=True)
+                    result = ask_library(
+                        st.session_state.library,
+                        prompt,
+                        top_k=top_k,
+                        min_score=min_score,
+                        ollama=qa_model if USE_OLLAMA else None
+                    )
+        else:
+            cache_key = None
+            result = None
+            try:
+                cache_key = answer_key(
+                    document.key,
+                    prompt,
+                    backend="api" if api is not None else "ollama" if USE_OLLAMA else "huggingface",
+                    model=(api_qa_model() if api is not None else qa_model.model_name if USE_OLLAMA
+                           else f"{QA_MODEL}@{registry.stats()['qa']['backend']}"),
+                    retrieval=retrieval_method,
+                    top_k=top_k,
+                    min_score=min_score
+                )
+            except requests.RequestException as e:
+                result = api_error_result(e)
+            if cache_key is not None and use_answer_cache:
+                result = get_answer_cache().get(cache_key)
+                if result is not None:
+                    # The stored timings are those of the original answer
+                    result = {key: value for key, value in result.items() if key != 'timings'}
+                    result['cached'] = True
+        
+            if result is None:
+                if api is not None:
+                    with st.spinner("Analyzing document..."):
+                        try:
+                            result = api.ask(
+                                document.key,
+                                prompt,
+                                retrieval=retrieval_method,
+                                top_k=top_k,
+                                min_score=min_score
+                            )
+                        except requests.RequestException as e:
+                            result = api_error_result(e)
+                elif USE_OLLAMA:
+                    with span("ollama.context"):
+                        context, sources = qa_model.build_context(
+                            document.text,
+                            prompt,
+                            retriever=get_retriever(retrieval_method),
+                            top_k=top_k,
+                            min_score=min_score
+                        )
+                    answer = ""
+                    try:
+                        with span("ollama.generate"):
+                            for token in qa_model.stream_with_context(context, prompt, raise_errors=True):
+                                answer += token
+                                message_placeholder.markdown(answer + "▌")
+                        result = {
+                            'answer': answer.strip() or "I couldn't generate a response. The model returned an empty answer.",
+                            'is_comprehensive': True,
+                            'sources': sources
+                        }
+                    except Exception as e:
+                        result = {
+                            'answer': f"Error getting response from Ollama: {str(e)}\n\n"
+                                      "Make sure Ollama is running and the model is downloaded.",
+                            'is_comprehensive': True,
+                            'error': True
+                        }
+                else:
+                    with st.spinner("Analyzing document..."):
+                        result = ask_question(
+                            document.text,
+                            prompt,
+                            document.index,
+                            retriever=get_retriever(retrieval_method),
+                            top_k=top_k,
+                            min_score=min_score,
+                            offsets=document.offsets
+                        )
+        
+                if use_answer_cache and not result.get('error'):
+                    get_answer_cache().put(cache_key, result)
+        
+        with span("app.render"):
+            message_placeholder.markdown(render_answer(result, document), unsafe_allow_html=True)
     
-    st.session_state.messages.append({"role": "assistant", "content": response})
+    st.session_state.last_trace = ("Last question", trace)
+    st.session_state.messages.append({"role": "assistant", "result": compact_result(result)})
     st.rerun()
 
 # Challenge Mode
 st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
 st.markdown('<h2 class="section-header">Challenge Mode: Test Your Understanding</h2>', unsafe_allow_html=True)
 
-if not st.session_state.document_text:
+if st.session_state.document is None:
     st.info("ℹPlease upload a document first to use Challenge Mode.")
 else:
+    bank = st.session_state.question_bank
+    if api is None and bank is not None:
+        bank_status = bank.status()
+        if bank_status['error']:
+            st.error(f"Error preparing challenge questions: {bank_status['error']}")
+            if st.button("Retry", key="retry_question_bank"):
+                start_question_bank(get_retriever(retrieval_method), bank)
+                st.rerun()
+        else:
+            st.progress(
+                min(1.0, bank_status['ready'] / bank_status['size']),
+                text=f"Question bank: {bank_status['ready']} ready, "
+                     f"{bank_status['covered']} of {bank_status['chunks']} sections covered"
+                     + (" (generating...)" if bank_status['building'] else "")
+            )
+    
     if st.button("Generate Challenge Questions", key="generate_questions", use_container_width=True):
-        with st.spinner("Creating challenging questions..."):
+        with st.spinner("Creating challenging questions..."), tracer.trace() as trace:
             try:
-                st.session_state.questions = generate_questions(st.session_state.document_text)
+                if api is not None:
+                    questions = api.challenge(
+                        st.session_state.document.key,
+                        retrieval=retrieval_method
+                    )
+                else:
+                    questions = []
+                    if bank is not None:
+                        # Instant when the bank is ready; otherwise wait for the batch in progress
+                        questions = bank.draw(
+                            QUESTION_COUNT,
+                            index=st.session_state.document.index,
+                            retriever=get_retriever(retrieval_method),
+                            timeout=60
+                        )
+                        get_document_cache().put_question_bank(st.session_state.document.key, bank)
+                    questions = questions or generate_questions(
+                        st.session_state.document.text,
+                        index=st.session_state.document.index,
+                        retriever=get_retriever(retrieval_method)
+                    )
+                st.session_state.questions = [compact_question(q) for q in questions]
                 st.session_state.show_questions = True
                 st.session_state.show_results = False
                 st.session_state.user_answers = {}
                 st.success("Challenge questions generated!")
+                st.session_state.last_trace = ("Challenge questions", trace)
                 st.rerun()
             except Exception as e:
                 st.error(f"Error generating questions: {str(e)}")
@@ -498,17 +1023,15 @@ else:
         
         if isinstance(st.session_state.questions[0], str):
             st.session_state.questions = [
-                {'question': q, 'context': st.session_state.document_text[:1000]}
+                {'question': q, 'context_start': 0, 'context_end': min(1000, len(st.session_state.document))}
                 for q in st.session_state.questions
             ]
         
         for i, question_data in enumerate(st.session_state.questions):
             if isinstance(question_data, dict):
                 question_text = question_data.get('question', 'No question text available')
-                question_context = question_data.get('context', '')
             else:
                 question_text = str(question_data)
-                question_context = st.session_state.document_text[:1000]
                 
             st.markdown(f"""
             <div style="
@@ -525,8 +1048,7 @@ else:
             if i not in st.session_state.user_answers:
                 st.session_state.user_answers[i] = {
                     'answer': '',
-                    'evaluation': None,
-                    'context': question_data.get('context', '')
+                    'evaluation': None
                 }
             
             answer = st.text_area(
@@ -551,9 +1073,8 @@ else:
                     st.markdown("**Relevant Document Excerpt:**")
                     st.markdown(f"> {eval_data['reference']}", unsafe_allow_html=True)
                     
-                    if 'full_context' in eval_data:
-                        with st.expander("📖 View Full Context"):
-                            st.markdown(eval_data['full_context'])
+                    with st.expander("📖 View Full Context"):
+                        st.markdown(question_context(question_data))
             
             st.markdown('<div class="divider"></div>', unsafe_allow_html=True)
         
@@ -564,18 +1085,13 @@ else:
                     if not all(ans['answer'].strip() for ans in st.session_state.user_answers.values()):
                         st.warning("Please answer all questions before submitting.")
                     else:
-                        for i, question_data in enumerate(st.session_state.questions):
-                            user_answer = st.session_state.user_answers[i]['answer']
-                            evaluation = evaluate_answer(question_data, user_answer)
-                            
-                            if isinstance(question_data, dict):
-                                context = question_data.get('context', '')
-                                if not context and 'context' in question_data:
-                                    context = question_data['context']
-                                evaluation['full_context'] = context or st.session_state.document_text[:1000]
-                            else:
-                                evaluation['full_context'] = st.session_state.document_text[:1000]
-                            
+                        evaluations = evaluate_answers(
+                            st.session_state.questions,
+                            [st.session_state.user_answers[i]['answer']
+                             for i in range(len(st.session_state.questions))],
+                            document_text=st.session_state.document.text
+                        )
+                        for i, evaluation in enumerate(evaluations):
                             st.session_state.user_answers[i]['evaluation'] = evaluation
                         st.session_state.show_results = True
                         st.rerun()
@@ -588,4 +1104,18 @@ else:
             if st.button(" Try Again with New Questions", key="new_questions", use_container_width=True):
                 st.session_state.show_questions = False
                 st.session_state.show_results = False
-                st.rerun()
\ No newline at end of file
+                st.rerun()
+
+# Timings panel, rendered last so it includes the stages of this run
+with st.sidebar:
+    st.markdown("---")
+    if st.checkbox("Show timings", value=False,
+                   help="Time spent in each stage of the last operation and in total"):
+        if st.session_state.last_trace:
+            label, spans = st.session_state.last_trace
+            st.markdown(f"**{label}**")
+            for name, seconds in spans:
+                st.caption(f"{name}: {seconds * 1000:,.0f} ms")
+        with st.expander("All stages"):
+            for name, stats in tracer.summary().items():
+                st.caption(f"{name}: {stats['count']}× avg {stats['mean'] * 1000:,.0f} ms")
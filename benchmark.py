@@ -0,0 +1,237 @@
+"""
+Benchmarks for the document pipeline.
+
+Times text cleaning, PDF extraction, chunking, extractive QA, summarization
+and question generation on synthetic documents of growing size. By default
+the models are replaced with deterministic stubs so the suite runs offline
+and measures the pipeline itself; --real-models uses the registry's models
+(from the local Hugging Face cache only).
+
+    python benchmark.py --sizes 1000 10000 100000 --output bench.json
+    python benchmark.py --compare bench.json --threshold 1.25
+"""
+from typing import Callable, Dict, List, Optional
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 1.25
+WORDS_PER_PAGE = 500
+# Stages that run a model once per chunk are skipped above this size with real models
+REAL_MODEL_MAX_WORDS = 10_000
+
+_VOCABULARY = [
+    "attention", "model", "layer", "training", "data", "results", "network", "encoder",
+    "decoder", "sequence", "token", "embedding", "performance", "baseline", "method",
+    "experiment", "evaluation", "accuracy", "parameters", "architecture", "transformer",
+    "language", "translation", "dataset", "loss", "gradient", "optimization", "benchmark"
+]
+_FILLER = ["the", "a", "of", "in", "and", "with", "for", "on", "is", "we", "this", "that"]
+
+
+def synthetic_document(words: int, seed: int = 0) -> str:
+    """Deterministic text of the given word count, in sentences of 8-20 words"""
+    rng = random.Random(seed)
+    out: List[str] = []
+    while len(out) < words:
+        length = min(rng.randint(8, 20), words - len(out))
+        sentence = [rng.choice(_VOCABULARY if rng.random() < 0.6 else _FILLER) for _ in range(length)]
+        sentence[0] = sentence[0].capitalize()
+        sentence[-1] += "."
+        out.extend(sentence)
+    return " ".join(out)
+
+
+def synthetic_pdf(text: str, words_per_page: int = WORDS_PER_PAGE) -> bytes:
+    """A minimal uncompressed PDF with the text laid out as Helvetica lines"""
+    words = text.split()
+    pages = [words[i:i + words_per_page] for i in range(0, len(words), words_per_page)] or [[]]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>"]
+    font_id = 3 + 2 * len(pages)
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    for i, page in enumerate(pages):
+        lines = [" ".join(page[j:j + 12]) for j in range(0, len(page), 12)]
+        body = " ".join(f"({line}) Tj 0 -14 Td" for line in lines)
+        stream = f"BT /F1 10 Tf 40 760 Td {body} ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {4 + 2 * i} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        out += f"{offset:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+def _stub_qa():
+    def answer(question: str, context: str) -> Dict:
+        words = context.split()
+        pick = (len(question) + len(words)) % max(1, len(words))
+        start = len(" ".join(words[:pick])) + (1 if pick else 0)
+        word = words[pick] if words else ""
+        return {'score': (len(context) % 97) / 100, 'start': start, 'end': start + len(word), 'answer': word}
+
+    def pipe(inputs=None, question=None, context=None, **kwargs):
+        if inputs is None:
+            return answer(question, context)
+        return [answer(item['question'], item['context']) for item in inputs]
+    return pipe
+
+
+def _stub_summarizer():
+    def pipe(texts, max_length=150, **kwargs):
+        single = isinstance(texts, str)
+        outputs = [{'summary_text': " ".join(text.split()[:max_length // 2])} for text in ([texts] if single else texts)]
+        return outputs[0] if single else outputs
+    return pipe
+
+
+def _stub_generator():
+    def pipe(prompts, **kwargs):
+        single = isinstance(prompts, str)
+        outputs = []
+        for prompt in ([prompts] if single else prompts):
+            topic = prompt.split()[-10] if len(prompt.split()) > 10 else "the document"
+            outputs.append([{'generated_text': f"{prompt} What does the text say about {topic}?"}])
+        return outputs[0] if single else outputs
+    return pipe
+
+
+def install_stub_models() -> None:
+    from model_registry import registry
+    registry.register('qa', _stub_qa)
+    registry.register('summarizer', _stub_summarizer)
+    registry.register('generator', _stub_generator)
+
+
+def _time(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return {'min': min(samples), 'median': statistics.median(samples)}
+
+
+def run(sizes: List[int], repeat: int, real_models: bool) -> Dict:
+    from utils import clean_text, extract_text_from_file, NamedBytesIO
+    from question_answering import extract_context, find_best_answer
+    from summarizer import generate_summary
+    from challenge_mode import generate_questions
+
+    question = "What results does the model achieve on the benchmark?"
+    results: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+    for size in sizes:
+        text = synthetic_document(size)
+        raw = text.replace(". ", ".\n\n  ")
+        pdf = synthetic_pdf(text)
+        stages = {
+            'clean_text': lambda: clean_text(raw),
+            'extract_pdf': lambda: extract_text_from_file(NamedBytesIO(pdf, "bench.pdf")),
+            'extract_context': lambda: extract_context(text),
+            'find_best_answer': lambda: find_best_answer(text, question),
+            'generate_summary': lambda: generate_summary(text, doc_key=f"bench-{size}-{time.perf_counter()}"),
+            'generate_questions': lambda: generate_questions(text)
+        }
+        for stage, fn in stages.items():
+            if real_models and size > REAL_MODEL_MAX_WORDS and stage in (
+                    'find_best_answer', 'generate_summary', 'generate_questions'):
+                continue
+            results.setdefault(stage, {})[str(size)] = _time(fn, repeat)
+            print(f"{stage:>20} {size:>9,} words: {results[stage][str(size)]['median'] * 1000:10.1f} ms")
+
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict, baseline: Dict, threshold: float,
+            stage_thresholds: Dict[str, float]) -> List[str]:
+    """Regressions of current over baseline as messages (median time ratio above the threshold)"""
+    regressions = []
+    for stage, by_size in current['results'].items():
+        limit = stage_thresholds.get(stage, threshold)
+        for size, timing in by_size.items():
+            base = baseline.get('results', {}).get(stage, {}).get(size)
+            if not base or base['median'] <= 0:
+                continue
+            ratio = timing['median'] / base['median']
+            if ratio > limit:
+                regressions.append(f"{stage} @ {size} words: {ratio:.2f}x slower (limit {limit:.2f}x)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Document sizes in words")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per stage")
+    parser.add_argument("--real-models", action="store_true", help="Use cached Hugging Face models instead of stubs")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Baseline JSON to check for regressions")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Maximum allowed median time ratio against the baseline")
+    parser.add_argument("--stage-threshold", action="append", default=[], metavar="STAGE=RATIO",
+                        help="Per-stage override of --threshold")
+    args = parser.parse_args(argv)
+
+    if args.real_models:
+        os.environ.setdefault("HF_HUB_OFFLINE", "1")
+    else:
+        install_stub_models()
+
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'models': 'real' if args.real_models else 'stub',
+        'repeat': args.repeat,
+        'results': run(args.sizes, args.repeat, args.real_models)
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        stage_thresholds = {}
+        for item in args.stage_threshold:
+            stage, _, ratio = item.partition("=")
+            stage_thresholds[stage] = float(ratio)
+        regressions = compare(report, baseline, args.threshold, stage_thresholds)
+        for message in regressions:
+            print(f"REGRESSION: {message}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
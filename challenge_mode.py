@@ -1,92 +1,86 @@
-from transformers import pipeline
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 import re
-from question_answering import extract_context, highlight_text
+from chunking import ChunkIndex
+from retrieval import retrieve_chunks, TOP_K
+from model_registry import registry
+from tracing import span
+from grading import evaluate_answers, reference_vectors
 
-generator = pipeline("text-generation", model="gpt2", device=-1)
 
-qa_pipeline = pipeline(
-    "question-answering",
-    model="distilbert-base-cased-distilled-squad",
-    device=-1
-)
+QUESTION_COUNT = 3
+GENERATION_PARAMS = {
+    'max_new_tokens': 40,
+    'num_return_sequences': 1,
+    'temperature': 0.7,
+    'do_sample': True,
+    'top_p': 0.9,
+    'truncation': True
+}
 
-def find_relevant_context(document_text: str, question: str) -> Dict:
-    chunks = extract_context(document_text)
-    best_score = 0
-    best_chunk = {
-        'text': document_text[:500],
-        'start': 0,
-        'end': min(500, len(document_text))
-    }
-    
-    for chunk in chunks:
-        try:
-            result = qa_pipeline(
-                question=question,
-                context=chunk['text'],
-                max_answer_len=150,
-                max_question_len=100,
-                max_seq_len=512
-            )
-            
-            if result['score'] > best_score:
-                best_score = result['score']
-                best_chunk = {
-                    'text': chunk['text'],
-                    'start': chunk['start'],
-                    'end': chunk['end'],
-                    'score': result['score']
-                }
-        except Exception as e:
-            print(f"Error finding context: {e}")
-            continue
-    
-    return best_chunk
-
-def generate_questions(document_text: str) -> List[Dict]:
-    chunks = extract_context(document_text)
-    
-    key_chunks = chunks[:3]
-    questions = []
-    
-    for chunk in key_chunks:
-        try:
-            prompt = f"""Generate one specific, detailed question that can be answered from the following text.
+def _question_prompt(text: str) -> str:
+    return f"""Generate one specific, detailed question that can be answered from the following text.
             The question should test comprehension and require understanding of the content.
             
-            Text: {chunk['text'][:1000]}
+            Text: {text[:1000]}
             
             Question:"""
-            
-            generated = generator(
-                prompt,
-                max_length=200,
-                num_return_sequences=1,
-                temperature=0.7,
-                do_sample=True,
-                top_p=0.9,
-                truncation=True
-            )
-            
-            output = generated[0]['generated_text']
-            question = output.split('Question:')[-1].split('?')[0].strip() + '?'
-            
-            context = find_relevant_context(document_text, question)
-            
-            questions.append({
-                'question': question,
-                'context': context['text'],
-                'context_start': context['start'],
-                'context_end': context['end']
-            })
-            
-            if len(questions) >= 3:
-                break
-                
-        except Exception as e:
-            print(f"Error generating question: {e}")
+
+def _parse_question(output: str) -> Optional[str]:
+    question = output.split('Question:')[-1].split('?')[0].strip()
+    return question + '?' if question else None
+
+def questions_for_chunks(index: ChunkIndex, chunk_ids: List[int], retriever=None,
+                         top_k: int = TOP_K) -> List[Dict]:
+    """
+    Generate one question per chunk, tied to the chunk it was generated from
+    
+    The prompts for all chunks go to the generator in one batched call. A
+    question's context is its source chunk; when a retriever is given, a
+    question counts as verified if retrieval finds its source chunk among the
+    top_k, and verified questions are listed first. Generator errors propagate.
+    """
+    if not chunk_ids:
+        return []
+    prompts = [_question_prompt(index.chunk_text(i)) for i in chunk_ids]
+    with span("challenge.generate"):
+        generated = registry.get('generator')(prompts, batch_size=len(prompts), **GENERATION_PARAMS)
+    
+    questions = []
+    for chunk_id, outputs in zip(chunk_ids, generated):
+        question = _parse_question(outputs[0]['generated_text'])
+        if question is None:
             continue
+        chunk = index.chunk(chunk_id)
+        # Grading vectors are built now, not when the answers come in
+        reference_vectors(chunk['text'])
+        verified = None
+        if retriever is not None:
+            with span("challenge.verify"):
+                retrieved = retrieve_chunks(retriever, question, top_k=top_k)
+            verified = retrieved is not None and chunk_id in retrieved
+        questions.append({
+            'question': question,
+            'context': chunk['text'],
+            'context_start': chunk['start'],
+            'context_end': chunk['end'],
+            'chunk_id': chunk_id,
+            'verified': verified
+        })
+    
+    questions.sort(key=lambda q: q['verified'] is False)
+    return questions
+
+def generate_questions(document_text: str, index: Optional[ChunkIndex] = None, retriever=None,
+                       count: int = QUESTION_COUNT, top_k: int = TOP_K) -> List[Dict]:
+    """Questions from the first count chunks, or generic ones if generation fails"""
+    if index is None:
+        index = retriever.chunk_index if retriever is not None else ChunkIndex(document_text)
+    
+    try:
+        questions = questions_for_chunks(index, list(range(min(count, len(index)))), retriever, top_k)
+    except Exception as e:
+        print(f"Error generating questions: {e}")
+        questions = []
     
     if not questions:
         questions = [
@@ -113,37 +107,4 @@ def generate_questions(document_text: str) -> List[Dict]:
     return questions
 
 def evaluate_answer(question_data: Dict, user_answer: str) -> Dict:
-    if not user_answer.strip():
-        return {
-            'is_correct': False,
-            'feedback': 'Please provide an answer.',
-            'reference': question_data['context']
-        }
-    
-    answer_keywords = set(word.lower() for word in user_answer.split() if len(word) > 3)
-    context_keywords = set(word.lower() for word in question_data['context'].split() if len(word) > 3)
-    
-    matching_keywords = answer_keywords.intersection(context_keywords)
-    match_ratio = len(matching_keywords) / max(1, len(answer_keywords))
-    
-    if match_ratio > 0.5:
-        return {
-            'is_correct': True,
-            'feedback': 'Your answer appears to be relevant to the document content.',
-            'reference': highlight_text(
-                question_data['context'],
-                question_data.get('answer_start', 0),
-                question_data.get('answer_end', 100)
-            )
-        }
-    else:
-        return {
-            'is_correct': False,
-            'feedback': 'Your answer may not fully address the question based on the document content.',
-            'reference': highlight_text(
-                question_data['context'],
-                question_data.get('context_start', 0),
-                question_data.get('context_end', 500)
-            )
-        }
-
+    return evaluate_answers([question_data], [user_answer])[0]
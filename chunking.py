@@ -0,0 +1,136 @@
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+import re
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+_WORD_RE = re.compile(r'\S+')
+
+
+def approx_token_count(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used when no tokenizer is given"""
+    return max(1, (len(text) + 3) // 4)
+
+
+class ChunkIndex:
+    """
+    Overlapping, word-aligned chunks of a document with exact character spans.
+
+    Word boundaries are located in a single regex pass and the size of every
+    word (in words or tokens) is accumulated into a prefix-sum array, so chunk
+    boundaries are found with binary searches instead of rescanning the word
+    list. Every span is a (start, end) pair into the original text, so
+    ``text[start:end]`` is exactly what the models see.
+
+    Args:
+        text: The document text
+        chunk_size: Maximum size of a chunk, measured in ``unit``
+        overlap: How much consecutive chunks share, measured in ``unit``
+        unit: 'words' or 'tokens'
+        token_counter: Returns the token count of a word when unit is 'tokens'
+            (defaults to approx_token_count)
+    """
+
+    def __init__(self, text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                 unit: str = 'words', token_counter: Optional[Callable[[str], int]] = None):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        if not 0 <= overlap < chunk_size:
+            raise ValueError("overlap must be smaller than chunk_size")
+        if unit not in ('words', 'tokens'):
+            raise ValueError(f"Unsupported chunk unit: {unit}")
+
+        self.text = text
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.unit = unit
+
+        self.word_starts: List[int] = []
+        self.word_ends: List[int] = []
+        # cumulative[i] is the size of words[:i] in the chosen unit
+        self.cumulative: List[int] = [0]
+
+        count = token_counter or approx_token_count
+        total = 0
+        for match in _WORD_RE.finditer(text):
+            self.word_starts.append(match.start())
+            self.word_ends.append(match.end())
+            total += 1 if unit == 'words' else count(match.group())
+            self.cumulative.append(total)
+
+        self.bounds: List[Tuple[int, int]] = self._build_bounds()
+
+    @classmethod
+    def from_arrays(cls, text: str, word_starts: Sequence[int], word_ends: Sequence[int],
+                    cumulative: Sequence[int], bounds: Sequence[Tuple[int, int]],
+                    chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                    unit: str = 'words') -> 'ChunkIndex':
+        """A ChunkIndex over precomputed word offsets and chunk bounds, e.g. memory-mapped arrays"""
+        index = cls.__new__(cls)
+        index.text = text
+        index.chunk_size = chunk_size
+        index.overlap = overlap
+        index.unit = unit
+        index.word_starts = word_starts
+        index.word_ends = word_ends
+        index.cumulative = cumulative
+        index.bounds = bounds
+        return index
+
+    def _build_bounds(self) -> List[Tuple[int, int]]:
+        """Word ranges [first, last) of every chunk"""
+        cumulative = self.cumulative
+        n_words = len(self.word_starts)
+        bounds = []
+        first = 0
+        while first < n_words:
+            last = bisect_right(cumulative, cumulative[first] + self.chunk_size) - 1
+            # A single word larger than chunk_size still gets its own chunk
+            last = min(max(last, first + 1), n_words)
+            bounds.append((first, last))
+            if last >= n_words:
+                break
+            next_first = bisect_left(cumulative, cumulative[last] - self.overlap)
+            first = max(next_first, first + 1)
+        return bounds
+
+    def __len__(self) -> int:
+        return len(self.bounds)
+
+    def __iter__(self) -> Iterator[Dict]:
+        for i in range(len(self.bounds)):
+            yield self.chunk(i)
+
+    @property
+    def word_count(self) -> int:
+        return len(self.word_starts)
+
+    def span(self, i: int) -> Tuple[int, int]:
+        """Character span of chunk i in the original text"""
+        first, last = self.bounds[i]
+        return int(self.word_starts[first]), int(self.word_ends[last - 1])
+
+    def chunk_text(self, i: int) -> str:
+        start, end = self.span(i)
+        return self.text[start:end]
+
+    def chunk(self, i: int) -> Dict:
+        start, end = self.span(i)
+        return {'text': self.text[start:end], 'start': start, 'end': end}
+
+    def chunks(self) -> List[Dict]:
+        """All chunks in the format historically returned by extract_context"""
+        return list(self)
+
+    def snap(self, start: int, end: int) -> Tuple[int, int]:
+        """Widen a character span so it does not cut through a word"""
+        if not len(self.word_starts):
+            return start, end
+        first = bisect_right(self.word_starts, start) - 1
+        if first >= 0 and self.word_ends[first] > start:
+            start = self.word_starts[first]
+        last = bisect_left(self.word_ends, end)
+        if last < len(self.word_ends) and self.word_starts[last] < end:
+            end = self.word_ends[last]
+        return start, end
@@ -0,0 +1,68 @@
+from typing import Dict, List, Optional, Tuple
+from chunking import ChunkIndex
+from index_store import content_hash
+from question_answering import highlight_text
+from utils import OffsetMap
+
+Span = Tuple[int, int]
+
+
+class Document:
+    """
+    A processed document: its text, held once, and the chunk index over it.
+
+    Everything derived from the document (chunks, question contexts, answer
+    highlights, sources) refers to it by (start, end) character spans and is
+    sliced out only when displayed. Documents are immutable, so one instance
+    can be shared by every session and cache that holds it.
+
+    Args:
+        text: Cleaned document text
+        key: Content hash identifying the document (a hash of the text by default)
+        index: ChunkIndex over text (built if not given)
+        offsets: OffsetMap from extraction, mapping text positions to source pages
+    """
+
+    __slots__ = ('text', 'key', 'index', 'offsets')
+
+    def __init__(self, text: str, key: Optional[str] = None, index: Optional[ChunkIndex] = None,
+                 offsets: Optional[OffsetMap] = None):
+        if index is None:
+            index = ChunkIndex(text)
+        object.__setattr__(self, 'text', text)
+        object.__setattr__(self, 'key', key or content_hash(text.encode('utf-8')))
+        object.__setattr__(self, 'index', index)
+        object.__setattr__(self, 'offsets', offsets)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Document is immutable")
+
+    def __getstate__(self) -> Dict:
+        return {'text': self.text, 'key': self.key, 'index': self.index, 'offsets': self.offsets}
+
+    def __setstate__(self, state: Dict) -> None:
+        object.__setattr__(self, 'offsets', None)
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def __len__(self) -> int:
+        return len(self.text)
+
+    @property
+    def word_count(self) -> int:
+        return self.index.word_count
+
+    def slice(self, span: Span) -> str:
+        start, end = span
+        return self.text[start:end]
+
+    def pages(self, span: Span) -> List[int]:
+        """1-based numbers of the source pages a span comes from (empty if unknown)"""
+        if self.offsets is None:
+            return []
+        return self.offsets.page_numbers(span[0], span[1])
+
+    def excerpt(self, span: Span, window: int = 100) -> str:
+        """The span with window characters of context, snapped to word boundaries and labelled with its pages"""
+        return highlight_text(self.text, span[0], span[1], window=window, index=self.index,
+                              offsets=self.offsets)
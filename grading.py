@@ -0,0 +1,162 @@
+from collections import Counter, OrderedDict
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import math
+import re
+import threading
+import numpy as np
+from retrieval import tokenize
+from question_answering import highlight_text
+
+# Cosine similarity with the best reference sentence needed to pass
+CORRECT_THRESHOLD = 0.3
+MAX_CACHED_REFERENCES = 256
+
+_SENTENCE_RE = re.compile(r'\S.*?(?:[.!?]+(?=\s|$)|$)', re.DOTALL)
+_SUFFIXES = ('ing', 'edly', 'ed', 'ly', 'es', 's')
+
+
+def _stem(term: str) -> str:
+    """Strip a common inflectional suffix so 'trained' matches 'training'"""
+    for suffix in _SUFFIXES:
+        if len(term) > len(suffix) + 3 and term.endswith(suffix):
+            return term[:-len(suffix)]
+    return term
+
+
+def _terms(text: str) -> List[str]:
+    return [_stem(t) for t in tokenize(text)]
+
+
+class ReferenceVectors:
+    """
+    TF-IDF vectors of the sentences of a question's context.
+
+    The sentences of the context are the documents for IDF, so terms specific
+    to one part of the context weigh more than ones repeated throughout.
+    Sentence vectors are L2-normalized rows of a (sentences x vocabulary) matrix.
+    """
+
+    def __init__(self, context: str):
+        self.spans: List[Tuple[int, int]] = []
+        sentence_terms: List[List[str]] = []
+        for match in _SENTENCE_RE.finditer(context):
+            terms = _terms(match.group())
+            if terms:
+                self.spans.append((match.start(), match.end()))
+                sentence_terms.append(terms)
+
+        self.vocabulary: Dict[str, int] = {}
+        df: Counter = Counter()
+        for terms in sentence_terms:
+            df.update(set(terms))
+        for term in df:
+            self.vocabulary[term] = len(self.vocabulary)
+
+        n = len(sentence_terms)
+        self.idf = np.array([math.log((n + 1) / (df[t] + 1)) + 1 for t in self.vocabulary], dtype=np.float32)
+        # Weight of terms that appear nowhere in the context
+        self.unseen_idf = math.log(n + 1) + 1
+
+        self.matrix = np.zeros((n, len(self.vocabulary)), dtype=np.float32)
+        for row, terms in enumerate(sentence_terms):
+            for term, count in Counter(terms).items():
+                self.matrix[row, self.vocabulary[term]] = count
+        self.matrix *= self.idf
+        norms = np.linalg.norm(self.matrix, axis=1, keepdims=True)
+        self.matrix /= np.maximum(norms, 1e-12)
+
+    def vectorize(self, texts: List[str]) -> np.ndarray:
+        """L2-normalized TF-IDF rows of texts in this context's vocabulary"""
+        vectors = np.zeros((len(texts), len(self.vocabulary)), dtype=np.float32)
+        unseen = np.zeros(len(texts), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for term, count in Counter(_terms(text)).items():
+                col = self.vocabulary.get(term)
+                if col is None:
+                    unseen[row] += (count * self.unseen_idf) ** 2
+                else:
+                    vectors[row, col] = count
+        vectors *= self.idf
+        # Terms missing from the context still count towards the answer's length
+        norms = np.sqrt((vectors ** 2).sum(axis=1) + unseen)
+        return vectors / np.maximum(norms, 1e-12)[:, None]
+
+
+_references: "OrderedDict[str, ReferenceVectors]" = OrderedDict()
+_references_lock = threading.Lock()
+
+
+def reference_vectors(context: str) -> ReferenceVectors:
+    """Cached ReferenceVectors of a context (computed when a question is created)"""
+    key = hashlib.sha1(context.encode('utf-8')).hexdigest()
+    with _references_lock:
+        reference = _references.get(key)
+        if reference is not None:
+            _references.move_to_end(key)
+            return reference
+    reference = ReferenceVectors(context)
+    with _references_lock:
+        _references[key] = reference
+        while len(_references) > MAX_CACHED_REFERENCES:
+            _references.popitem(last=False)
+    return reference
+
+
+def evaluate_answers(questions: List[Dict], answers: List[str], threshold: float = CORRECT_THRESHOLD,
+                     document_text: Optional[str] = None) -> List[Dict]:
+    """
+    Grade many answers at once against the contexts of their questions
+
+    Answers are grouped by context, so each distinct context takes one matrix
+    product however many users answered its question. An answer's score is
+    its cosine similarity with the best-matching sentence of the context.
+    Questions without a 'context' are resolved from their context_start and
+    context_end in document_text.
+
+    Returns:
+        Per answer: is_correct, score, feedback, the reference excerpt and the
+        (reference_start, reference_end) span of the best sentence in the context
+    """
+    results: List[Optional[Dict]] = [None] * len(answers)
+    groups: Dict[str, List[int]] = {}
+    for i, (question, answer) in enumerate(zip(questions, answers)):
+        context = question.get('context')
+        if context is None:
+            context = document_text[question['context_start']:question['context_end']]
+        if not answer.strip():
+            results[i] = {
+                'is_correct': False,
+                'score': 0.0,
+                'feedback': 'Please provide an answer.',
+                'reference': context
+            }
+        else:
+            groups.setdefault(context, []).append(i)
+
+    for context, members in groups.items():
+        reference = reference_vectors(context)
+        if not reference.spans:
+            similarities = np.zeros((len(members), 1), dtype=np.float32)
+            spans = [(0, len(context))]
+        else:
+            similarities = reference.vectorize([answers[i] for i in members]) @ reference.matrix.T
+            spans = reference.spans
+        best = similarities.argmax(axis=1)
+        scores = similarities[np.arange(len(members)), best]
+
+        for i, sentence, score in zip(members, best, scores):
+            start, end = spans[sentence]
+            is_correct = bool(score >= threshold)
+            results[i] = {
+                'is_correct': is_correct,
+                'score': round(float(score), 3),
+                'feedback': (
+                    'Your answer appears to be relevant to the document content.' if is_correct else
+                    'Your answer may not fully address the question based on the document content.'
+                ),
+                'reference': highlight_text(context, start, end),
+                'reference_start': start,
+                'reference_end': end
+            }
+    return results
@@ -0,0 +1,367 @@
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import numpy as np
+from chunking import ChunkIndex
+from retrieval import BM25Index, EmbeddingIndex
+from utils import OffsetMap
+
+INDEX_DIR = os.environ.get(
+    "INDEX_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "genai-research-assistant", "indexes")
+)
+MAX_INDEX_BYTES = int(os.environ.get("INDEX_MAX_BYTES", 4 * 1024 ** 3))
+# Bumped whenever the layout below changes; entries of other versions are rebuilt
+INDEX_FORMAT = 1
+
+_MANIFEST = "manifest.json"
+_TEXT = "text.txt"
+
+
+def content_hash(data: bytes) -> str:
+    """Store key of an uploaded file"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _save_columns(path: str, columns: Dict[str, np.ndarray]) -> Dict[str, List]:
+    """
+    Write int64 columns back to back into one .npy file
+
+    Returns:
+        The layout to store in the manifest: name -> [offset, shape]
+    """
+    layout = {}
+    offset = 0
+    for name, column in columns.items():
+        layout[name] = [offset, list(column.shape)]
+        offset += column.size
+    packed = np.concatenate([column.ravel() for column in columns.values()]) if columns else np.zeros(0)
+    np.save(path, packed.astype(np.int64, copy=False))
+    return layout
+
+
+def _load_columns(path: str, layout: Dict[str, List]) -> Dict[str, np.ndarray]:
+    """Zero-copy views of the columns of a file written by _save_columns"""
+    packed = np.load(path, mmap_mode="r")
+    columns = {}
+    for name, (offset, shape) in layout.items():
+        size = int(np.prod(shape))
+        columns[name] = packed[offset:offset + size].reshape(shape)
+    return columns
+
+
+def _replace_file(path: str, data: bytes) -> None:
+    """Write a file through a temporary file in the same directory, so readers never see it partly written"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class StoredPostings(Mapping):
+    """
+    Read-only BM25 postings kept in columnar arrays.
+
+    The postings of term i are chunks[offsets[i]:offsets[i + 1]] with the
+    matching freqs; only the term -> row table is built in memory.
+    """
+
+    def __init__(self, terms: List[str], offsets: np.ndarray, chunks: np.ndarray, freqs: np.ndarray):
+        self.terms = terms
+        self.offsets = offsets
+        self.chunks = chunks
+        self.freqs = freqs
+        self._rows: Optional[Dict[str, int]] = None
+
+    @property
+    def rows(self) -> Dict[str, int]:
+        # Built on the first lookup; opening a library only needs frequencies()
+        if self._rows is None:
+            self._rows = {term: i for i, term in enumerate(self.terms)}
+        return self._rows
+
+    def __getitem__(self, term: str) -> List[Tuple[int, int]]:
+        i = self.rows[term]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return list(zip(self.chunks[start:end].tolist(), self.freqs[start:end].tolist()))
+
+    def frequencies(self) -> Dict[str, int]:
+        """Postings length of every term, without materializing the postings"""
+        return dict(zip(self.terms, np.diff(self.offsets).tolist()))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.terms)
+
+    def __len__(self) -> int:
+        return len(self.terms)
+
+
+class IndexStore:
+    """
+    Persistent, versioned store of processed documents, one directory per document.
+
+    Entries are keyed by content_hash() of the uploaded file and laid out for
+    fast loading instead of pickled:
+
+        <key>/manifest.json      format version, summary, chunking and retriever parameters
+        <key>/text.txt           cleaned text (UTF-8)
+        <key>/chunks.npy         word offsets, prefix sums and chunk bounds, stored column
+                                 after column (positions in the manifest)
+        <key>/offsets.npy        OffsetMap columns (text position -> source page), if known
+        <key>/<retriever>/       BM25: terms.json and postings.npy (columns: term offsets,
+                                 chunk ids, frequencies, chunk lengths); embeddings:
+                                 vectors.npy and, for int8, scales.npy
+        <key>/question_bank.pkl  the challenge question bank
+
+    Arrays are opened with numpy memory maps, so get() reads only the manifest,
+    the text and the BM25 term list; chunk offsets and embedding matrices are
+    paged in on use, and worker processes opening the same entry share those
+    pages through the OS page cache. Entries are written to a temporary
+    directory and swapped into place, so readers never see a partial entry
+    (memory maps of a replaced entry stay valid until they are closed).
+    Entries of another INDEX_FORMAT are discarded and rebuilt. The question
+    bank changes on every draw, so put_question_bank() rewrites it alone. It
+    is unpickled, so the store must only be writable by the app itself.
+    """
+
+    def __init__(self, root: str = INDEX_DIR, max_bytes: int = MAX_INDEX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def keys(self) -> List[str]:
+        """Keys of the stored documents"""
+        return [name for name in os.listdir(self.root)
+                if not name.startswith(".") and os.path.isfile(os.path.join(self.root, name, _MANIFEST))]
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, _MANIFEST)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Discarding unreadable index {key}: {e}")
+            self.delete(key)
+            return None
+        if manifest.get('format') != INDEX_FORMAT:
+            print(f"Discarding index {key} in format {manifest.get('format')} (expected {INDEX_FORMAT})")
+            self.delete(key)
+            return None
+        try:
+            entry = self._load(path, manifest)
+        except FileNotFoundError:
+            # Replaced or evicted by another process while loading
+            return None
+        except Exception as e:
+            print(f"Discarding unreadable index {key}: {e}")
+            self.delete(key)
+            return None
+        try:
+            os.utime(os.path.join(path, _MANIFEST))
+        except OSError:
+            pass
+        return entry
+
+    def _load(self, path: str, manifest: Dict) -> Dict[str, Any]:
+        # newline="" keeps the text byte-for-byte, so stored character offsets stay valid
+        with open(os.path.join(path, _TEXT), encoding="utf-8", newline="") as f:
+            text = f.read()
+        chunking = manifest['chunking']
+        arrays = _load_columns(os.path.join(path, "chunks.npy"), manifest['chunks'])
+        chunk_index = ChunkIndex.from_arrays(text, **arrays, **chunking)
+        offsets = None
+        if manifest.get('offsets'):
+            offsets = OffsetMap.from_arrays(**_load_columns(os.path.join(path, "offsets.npy"), manifest['offsets']))
+
+        retrievers = {}
+        for name, info in manifest['retrievers'].items():
+            directory = os.path.join(path, info['dir'])
+            if info['type'] == 'bm25':
+                with open(os.path.join(directory, "terms.json"), encoding="utf-8") as f:
+                    terms = json.load(f)
+                columns = _load_columns(os.path.join(directory, "postings.npy"), info['postings'])
+                postings = StoredPostings(terms, columns['offsets'], columns['chunks'], columns['freqs'])
+                retrievers[name] = BM25Index.from_postings(chunk_index, postings, columns['lengths'],
+                                                           k1=info['k1'], b=info['b'])
+            else:
+                vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+                scales = None
+                if info['dtype'] == 'int8':
+                    scales = np.load(os.path.join(directory, "scales.npy"), mmap_mode="r")
+                retrievers[name] = EmbeddingIndex.from_vectors(chunk_index, vectors, scales)
+
+        question_bank = None
+        if manifest.get('question_bank'):
+            with open(os.path.join(path, "question_bank.pkl"), "rb") as f:
+                question_bank = pickle.load(f)
+
+        return {
+            'name': manifest.get('name'),
+            'text': text,
+            'chunk_index': chunk_index,
+            'offsets': offsets,
+            'summary': manifest.get('summary', ""),
+            'retrievers': retrievers,
+            'question_bank': question_bank
+        }
+
+    def put(self, key: str, entry: Dict[str, Any]) -> None:
+        tmp_path = tempfile.mkdtemp(dir=self.root, prefix=".tmp-")
+        try:
+            self._write(tmp_path, entry)
+            self._swap(tmp_path, self._path(key))
+        except Exception as e:
+            print(f"Could not write index {key}: {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.evict()
+
+    def _write(self, path: str, entry: Dict[str, Any]) -> None:
+        with open(os.path.join(path, _TEXT), "w", encoding="utf-8", newline="") as f:
+            f.write(entry['text'])
+
+        chunk_index = entry['chunk_index']
+        chunks = _save_columns(os.path.join(path, "chunks.npy"), {
+            'word_starts': np.asarray(chunk_index.word_starts, dtype=np.int64),
+            'word_ends': np.asarray(chunk_index.word_ends, dtype=np.int64),
+            'cumulative': np.asarray(chunk_index.cumulative, dtype=np.int64),
+            'bounds': np.asarray(chunk_index.bounds, dtype=np.int64).reshape(-1, 2)
+        })
+
+        offsets = None
+        if entry.get('offsets') is not None:
+            offsets = _save_columns(os.path.join(path, "offsets.npy"), {
+                name: np.asarray(getattr(entry['offsets'], name), dtype=np.int64)
+                for name in ('starts', 'deltas', 'pages')
+            })
+
+        retrievers = {}
+        for i, (name, retriever) in enumerate((entry.get('retrievers') or {}).items()):
+            directory = f"retriever-{i}"
+            os.makedirs(os.path.join(path, directory))
+            if isinstance(retriever, BM25Index):
+                retrievers[name] = {
+                    'type': 'bm25', 'dir': directory, 'k1': retriever.k1, 'b': retriever.b,
+                    'postings': self._write_postings(os.path.join(path, directory), retriever)
+                }
+            elif isinstance(retriever, EmbeddingIndex):
+                retrievers[name] = {'type': 'embeddings', 'dir': directory, 'dtype': retriever.dtype}
+                np.save(os.path.join(path, directory, "vectors.npy"), np.asarray(retriever.vectors))
+                if retriever.scales is not None:
+                    np.save(os.path.join(path, directory, "scales.npy"), np.asarray(retriever.scales))
+            else:
+                print(f"Not storing retriever {name}: unsupported type {type(retriever).__name__}")
+
+        if entry.get('question_bank') is not None:
+            with open(os.path.join(path, "question_bank.pkl"), "wb") as f:
+                pickle.dump(entry['question_bank'], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        manifest = {
+            'format': INDEX_FORMAT,
+            'name': entry.get('name'),
+            'summary': entry.get('summary', ""),
+            'chunking': {
+                'chunk_size': chunk_index.chunk_size,
+                'overlap': chunk_index.overlap,
+                'unit': chunk_index.unit
+            },
+            'chunks': chunks,
+            'offsets': offsets,
+            'retrievers': retrievers,
+            'question_bank': entry.get('question_bank') is not None
+        }
+        # Written last: an entry without a manifest is never read
+        with open(os.path.join(path, _MANIFEST), "w") as f:
+            json.dump(manifest, f)
+
+    def put_question_bank(self, key: str, question_bank) -> None:
+        """Replace only the question bank of a stored entry (a no-op if the entry is not stored)"""
+        path = self._path(key)
+        manifest_path = os.path.join(path, _MANIFEST)
+        try:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+            _replace_file(os.path.join(path, "question_bank.pkl"),
+                          pickle.dumps(question_bank, protocol=pickle.HIGHEST_PROTOCOL))
+            if not manifest.get('question_bank'):
+                manifest['question_bank'] = True
+                _replace_file(manifest_path, json.dumps(manifest).encode("utf-8"))
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"Could not write question bank of index {key}: {e}")
+
+    @staticmethod
+    def _write_postings(directory: str, retriever: BM25Index) -> Dict[str, List]:
+        terms = list(retriever.postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        chunks, freqs = [], []
+        for i, term in enumerate(terms):
+            postings = retriever.postings[term]
+            offsets[i + 1] = offsets[i] + len(postings)
+            for chunk_id, freq in postings:
+                chunks.append(chunk_id)
+                freqs.append(freq)
+        with open(os.path.join(directory, "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f)
+        return _save_columns(os.path.join(directory, "postings.npy"), {
+            'offsets': offsets,
+            'chunks': np.asarray(chunks, dtype=np.int64),
+            'freqs': np.asarray(freqs, dtype=np.int64),
+            'lengths': np.asarray(retriever.lengths, dtype=np.int64)
+        })
+
+    def _swap(self, tmp_path: str, path: str) -> None:
+        """Move a written entry into place, replacing any existing one"""
+        try:
+            os.rename(tmp_path, path)
+            return
+        except OSError:
+            pass
+        # A directory cannot be renamed over a non-empty one: move the old entry aside first
+        old_path = tempfile.mkdtemp(dir=self.root, prefix=".old-")
+        os.rename(path, os.path.join(old_path, "entry"))
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def delete(self, key: str) -> None:
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        entries = []
+        for key in self.keys():
+            path = self._path(key)
+            try:
+                mtime = os.stat(os.path.join(path, _MANIFEST)).st_mtime
+                size = sum(os.path.getsize(os.path.join(directory, name))
+                           for directory, _, names in os.walk(path) for name in names)
+            except FileNotFoundError:
+                continue
+            entries.append((mtime, size, path))
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self) -> None:
+        """Remove least recently used entries until the store fits in max_bytes"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
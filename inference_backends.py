@@ -0,0 +1,226 @@
+"""
+CPU inference backends for the Hugging Face pipelines.
+
+Each model in the registry can run as
+
+- 'torch': the stock fp32 PyTorch pipeline
+- 'int8': PyTorch with dynamic int8 quantization of the Linear layers
+- 'onnx': an ONNX export run with ONNX Runtime (needs ``optimum[onnxruntime]``)
+
+chosen per model with QA_BACKEND and SUMMARIZER_BACKEND. The result is an
+ordinary transformers pipeline, so callers such as ask_question and
+generate_summary do not change. ONNX exports are cached in ONNX_CACHE_DIR.
+With VERIFY_BACKENDS=1 a non-torch backend is compared with fp32 on a fixed
+sample when it loads, and fp32 is used instead if they disagree. The same
+check can be run by hand before switching a model:
+
+    python inference_backends.py qa int8
+"""
+from typing import Callable, Dict, List, Optional
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+BACKENDS = ('torch', 'int8', 'onnx')
+ONNX_CACHE_DIR = os.environ.get(
+    "ONNX_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "genai-research-assistant", "onnx")
+)
+VERIFY_BACKENDS = os.environ.get("VERIFY_BACKENDS", "0") == "1"
+# Minimum agreement with fp32 on the sample for a backend to pass verification
+MIN_AGREEMENT = 0.8
+
+_TASK_MODELS = {
+    'question-answering': ('AutoModelForQuestionAnswering', 'ORTModelForQuestionAnswering'),
+    'summarization': ('AutoModelForSeq2SeqLM', 'ORTModelForSeq2SeqLM'),
+    'text-generation': ('AutoModelForCausalLM', 'ORTModelForCausalLM')
+}
+
+QA_SAMPLE = [
+    ("What architecture does the paper propose?",
+     "We propose a new simple network architecture, the Transformer, based solely on attention "
+     "mechanisms, dispensing with recurrence and convolutions entirely."),
+    ("What BLEU score does the model achieve?",
+     "Our model achieves 28.4 BLEU on the WMT 2014 English-to-German translation task, improving "
+     "over the existing best results, including ensembles, by over 2 BLEU."),
+    ("How long did training take?",
+     "The big model was trained for 3.5 days on eight P100 GPUs, a small fraction of the training "
+     "costs of the best models from the literature."),
+    ("What is used instead of recurrence?",
+     "Self-attention, sometimes called intra-attention, relates different positions of a single "
+     "sequence in order to compute a representation of the sequence."),
+    ("How many layers does the encoder have?",
+     "The encoder is composed of a stack of N = 6 identical layers. Each layer has two sub-layers: "
+     "a multi-head self-attention mechanism and a position-wise fully connected feed-forward network.")
+]
+
+SUMMARY_SAMPLE = [
+    "The dominant sequence transduction models are based on complex recurrent or convolutional neural "
+    "networks that include an encoder and a decoder. The best performing models also connect the encoder "
+    "and decoder through an attention mechanism. We propose a new simple network architecture, the "
+    "Transformer, based solely on attention mechanisms, dispensing with recurrence and convolutions "
+    "entirely. Experiments on two machine translation tasks show these models to be superior in quality "
+    "while being more parallelizable and requiring significantly less time to train.",
+    "Retrieval-augmented generation combines a parametric language model with a non-parametric memory. "
+    "A retriever selects passages from a large corpus for each input, and the generator conditions on "
+    "them to produce the output. On open-domain question answering the approach sets a new state of the "
+    "art, and its generations are more specific, diverse and factual than those of a parametric-only "
+    "baseline."
+]
+
+
+def _export_dir(model_name: str) -> str:
+    return os.path.join(ONNX_CACHE_DIR, model_name.replace("/", "--"))
+
+
+def _onnx_model(task: str, model_name: str):
+    """ONNX Runtime model for task, exported on first use and loaded from the cache afterwards"""
+    try:
+        import optimum.onnxruntime as ort
+    except ImportError:
+        raise RuntimeError("The 'onnx' backend needs optimum[onnxruntime]: pip install optimum[onnxruntime]")
+    from transformers import AutoTokenizer
+    model_class = getattr(ort, _TASK_MODELS[task][1])
+    path = _export_dir(model_name)
+
+    if not os.path.isdir(path):
+        os.makedirs(ONNX_CACHE_DIR, exist_ok=True)
+        # Export into a temporary directory and rename it, so an interrupted
+        # export never leaves a half-written model in the cache
+        tmp = tempfile.mkdtemp(dir=ONNX_CACHE_DIR, prefix=".export-")
+        try:
+            model_class.from_pretrained(model_name, export=True).save_pretrained(tmp)
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(tmp)
+            os.replace(tmp, path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    return model_class.from_pretrained(path), AutoTokenizer.from_pretrained(path)
+
+
+def _int8_model(task: str, model_name: str):
+    import torch
+    import transformers
+    model = getattr(transformers, _TASK_MODELS[task][0]).from_pretrained(model_name)
+    model.eval()
+    model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model, transformers.AutoTokenizer.from_pretrained(model_name)
+
+
+def build_pipeline(task: str, model_name: str, backend: str = 'torch', verify: bool = VERIFY_BACKENDS):
+    """
+    A transformers pipeline for task running on the given CPU backend
+
+    Args:
+        task: Pipeline task ('question-answering', 'summarization' or 'text-generation')
+        model_name: Hugging Face model id
+        backend: One of BACKENDS
+        verify: Check the backend against fp32 on the sample and fall back to fp32
+            if their agreement is below MIN_AGREEMENT
+    
+    The backend the pipeline actually runs on is set as its inference_backend.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    from transformers import pipeline
+    if backend == 'torch':
+        reference = pipeline(task, model=model_name, device=-1)
+        reference.inference_backend = 'torch'
+        return reference
+    if backend == 'int8':
+        model, tokenizer = _int8_model(task, model_name)
+    else:
+        model, tokenizer = _onnx_model(task, model_name)
+    candidate = pipeline(task, model=model, tokenizer=tokenizer, device=-1)
+    candidate.inference_backend = backend
+
+    if verify and task in _COMPARISONS:
+        reference = build_pipeline(task, model_name, 'torch')
+        report = _COMPARISONS[task](reference, candidate)
+        if report['agreement'] < MIN_AGREEMENT:
+            print(f"Error verifying {backend} backend of {model_name} "
+                  f"(agreement with fp32 {report['agreement']:.2f}), using fp32 instead")
+            return reference
+        print(f"{backend} backend of {model_name} verified (agreement with fp32 {report['agreement']:.2f})")
+    return candidate
+
+
+def _token_f1(a: str, b: str) -> float:
+    a_tokens, b_tokens = a.lower().split(), b.lower().split()
+    if not a_tokens or not b_tokens:
+        return float(a_tokens == b_tokens)
+    common = sum(min(a_tokens.count(t), b_tokens.count(t)) for t in set(a_tokens))
+    if not common:
+        return 0.0
+    precision, recall = common / len(a_tokens), common / len(b_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+def _compare_qa(reference, candidate) -> Dict[str, float]:
+    matches, f1, score_delta = 0, 0.0, 0.0
+    for question, context in QA_SAMPLE:
+        expected = reference(question=question, context=context)
+        actual = candidate(question=question, context=context)
+        matches += expected['answer'].strip() == actual['answer'].strip()
+        f1 += _token_f1(expected['answer'], actual['answer'])
+        score_delta += abs(expected['score'] - actual['score'])
+    n = len(QA_SAMPLE)
+    return {'agreement': f1 / n, 'exact_match': matches / n, 'mean_score_delta': score_delta / n}
+
+
+def _compare_summaries(reference, candidate) -> Dict[str, float]:
+    settings = dict(max_length=80, min_length=20, do_sample=False, truncation=True)
+    expected = reference(SUMMARY_SAMPLE, **settings)
+    actual = candidate(SUMMARY_SAMPLE, **settings)
+    f1 = [_token_f1(e['summary_text'], a['summary_text']) for e, a in zip(expected, actual)]
+    exact = [e['summary_text'] == a['summary_text'] for e, a in zip(expected, actual)]
+    return {'agreement': sum(f1) / len(f1), 'exact_match': sum(exact) / len(exact)}
+
+
+_COMPARISONS: Dict[str, Callable] = {
+    'question-answering': _compare_qa,
+    'summarization': _compare_summaries
+}
+
+
+def accuracy_delta(task: str, model_name: str, backend: str) -> Dict[str, float]:
+    """
+    Compare a backend with the fp32 torch pipeline on the fixed sample
+
+    Returns:
+        'agreement' (mean token F1 between the outputs, 1.0 when identical),
+        'exact_match' rate and, for QA, the mean absolute confidence difference
+    """
+    if task not in _COMPARISONS:
+        raise ValueError(f"No accuracy sample for task: {task}")
+    return _COMPARISONS[task](
+        build_pipeline(task, model_name, 'torch'),
+        build_pipeline(task, model_name, backend, verify=False)
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    from model_registry import MODEL_TASKS
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("model", choices=sorted(MODEL_TASKS), help="Registry name of the model")
+    parser.add_argument("backend", choices=BACKENDS[1:], help="Backend to compare with fp32")
+    parser.add_argument("--min-agreement", type=float, default=MIN_AGREEMENT)
+    args = parser.parse_args(argv)
+
+    task, model_name = MODEL_TASKS[args.model]
+    report = accuracy_delta(task, model_name, args.backend)
+    for key, value in report.items():
+        print(f"{key:>18}: {value:.3f}")
+    if report['agreement'] < args.min_agreement:
+        print(f"{args.backend} disagrees with fp32 more than allowed (agreement < {args.min_agreement})")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,149 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import os
+import threading
+import time
+from tracing import span
+from utils import extract_text_with_offsets, NamedBytesIO, OffsetMap
+from chunking import ChunkIndex
+from document import Document
+from summarizer import generate_summary
+from question_bank import QuestionBank
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+# Shared by every session of the process, like the model registry
+_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="document-jobs")
+
+
+class Job:
+    """
+    A pipeline of named stages run in order on the shared background pool.
+
+    Each stage is a function of the job that returns the stage's result; later
+    stages read earlier results with job.result(name). Results and per-stage
+    status can be polled from any thread while the job runs, so callers can use
+    the output of early stages before the slow ones finish. A stage runs only
+    if the stages it requires are done, so a failure skips the stages that
+    depend on it and nothing else.
+
+    Args:
+        stages: (name, function) pairs, or (name, function, required stage names)
+            triples, in execution order; a pair requires every earlier stage
+        span_prefix: Prefix of the tracing span recorded for each stage
+    """
+
+    def __init__(self, stages: List[Tuple], span_prefix: str = "job"):
+        self.stages: List[Tuple[str, Callable[['Job'], Any], Tuple[str, ...]]] = [
+            stage if len(stage) == 3 else (stage[0], stage[1], tuple(name for name, *_ in stages[:i]))
+            for i, stage in enumerate(stages)
+        ]
+        self.span_prefix = span_prefix
+        self._results: Dict[str, Any] = {}
+        self._status: Dict[str, Dict] = {
+            name: {'state': PENDING, 'seconds': None, 'progress': None, 'error': None}
+            for name, *_ in stages
+        }
+        self._lock = threading.Lock()
+        self._future: Optional[Future] = None
+
+    def start(self) -> 'Job':
+        self._future = _executor.submit(self._run)
+        return self
+
+    def _run(self) -> None:
+        for name, stage, requires in self.stages:
+            with self._lock:
+                blocked = any(self._status[required]['state'] != DONE for required in requires)
+            if blocked:
+                self._update(name, state=SKIPPED)
+                continue
+            self._update(name, state=RUNNING)
+            start = time.perf_counter()
+            try:
+                with span(f"{self.span_prefix}.{name}"):
+                    result = stage(self)
+            except Exception as e:
+                print(f"Error in {self.span_prefix} stage {name}: {e}")
+                self._update(name, state=FAILED, error=str(e), seconds=time.perf_counter() - start)
+                continue
+            with self._lock:
+                self._results[name] = result
+                self._status[name].update(state=DONE, seconds=time.perf_counter() - start)
+
+    def _update(self, name: str, **fields) -> None:
+        with self._lock:
+            self._status[name].update(fields)
+
+    def progress(self, name: str, fraction: float) -> None:
+        """Report progress (0 to 1) of a running stage"""
+        self._update(name, progress=fraction)
+
+    def ready(self, name: str) -> bool:
+        with self._lock:
+            return name in self._results
+
+    def result(self, name: str) -> Any:
+        """Result of a finished stage (None if it has not finished)"""
+        with self._lock:
+            return self._results.get(name)
+
+    def status(self) -> Dict[str, Dict]:
+        """State, duration (seconds), progress and error of every stage"""
+        with self._lock:
+            return {name: dict(status) for name, status in self._status.items()}
+
+    @property
+    def finished(self) -> bool:
+        return self._future is not None and self._future.done()
+
+
+def document_job(name: str, data: bytes, doc_key: str,
+                 make_retriever: Callable[[ChunkIndex], Any]) -> Job:
+    """
+    Start processing an uploaded document in the background
+
+    Stages, in order: 'extract' (text and its OffsetMap), 'chunking' (the
+    Document with its ChunkIndex), 'index' (retriever built by make_retriever),
+    'questions' (QuestionBank, filled in the background from then on) and
+    'summary'. Only 'chunking' is required by the last three, so a failed
+    index (e.g. the embedder cannot be downloaded) still leaves questions,
+    generated without retrieval checks, and a summary.
+    """
+    def extract(job: Job) -> Tuple[str, Optional[OffsetMap]]:
+        return extract_text_with_offsets(
+            NamedBytesIO(data, name),
+            progress_callback=lambda done, total: job.progress('extract', done / total)
+        )
+
+    def chunking(job: Job) -> Document:
+        text, offsets = job.result('extract')
+        return Document(text, doc_key, offsets=offsets)
+
+    def questions(job: Job) -> QuestionBank:
+        index = job.result('chunking').index
+        bank = QuestionBank(len(index))
+        # None if the index stage failed
+        bank.fill(index, job.result('index'))
+        return bank
+
+    return Job([
+        ('extract', extract),
+        ('chunking', chunking),
+        ('index', lambda job: make_retriever(job.result('chunking').index), ('chunking',)),
+        ('questions', questions, ('chunking',)),
+        ('summary', lambda job: generate_summary(job.result('chunking').text, doc_key=doc_key), ('chunking',))
+    ], span_prefix="upload").start()
+
+
+def summary_job(document: Document) -> Job:
+    """Summarize an already processed document in the background (stage 'summary')"""
+    return Job([
+        ('summary', lambda job: generate_summary(document.text, doc_key=document.key))
+    ], span_prefix="upload").start()
@@ -0,0 +1,319 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Collection, Dict, List, Optional, Tuple
+import heapq
+import math
+import os
+import threading
+from document import Document
+from retrieval import BM25Index, tokenize, TOP_K, MIN_SCORE
+from question_answering import run_qa, highlight_text
+from tracing import span
+
+LIBRARY_WORKERS = int(os.environ.get("LIBRARY_WORKERS", 4))
+# Documents searched per question, chosen by their document-level term statistics
+CANDIDATE_DOCUMENTS = 8
+# Chunks retrieved from each searched document before the global merge
+PER_DOCUMENT_TOP_K = 3
+
+NO_ANSWER = "I couldn't find a clear answer in the library."
+
+# Shared by every library of the process
+_executor = ThreadPoolExecutor(max_workers=LIBRARY_WORKERS, thread_name_prefix="library-search")
+
+Hit = Tuple[str, int, float]
+
+
+class DocumentLibrary:
+    """
+    A set of documents, each indexed once, that can be questioned together.
+
+    A question is answered in three steps. A document-level inverted index
+    (term -> number of chunks containing it, per document) picks the few
+    documents most likely to hold the answer, so the cost of a question grows
+    with the documents that share its terms rather than with the library.
+    Those documents are searched in parallel, each with its own retriever, and
+    their hits are merged into one global top_k. BM25 retrievers score with
+    IDF computed over the chunks of the whole library, so their scores can be
+    compared across documents; embedding retrievers return cosine similarities,
+    which already can. The term counts of added documents are merged into the
+    document-level index by the next search, so opening a large library only
+    costs reading each document's term counts.
+
+    Args:
+        make_retriever: Builds the retriever of a document from its ChunkIndex
+        candidate_documents: Number of documents searched per question
+    """
+
+    def __init__(self, make_retriever: Callable = BM25Index,
+                 candidate_documents: int = CANDIDATE_DOCUMENTS):
+        self.make_retriever = make_retriever
+        self.candidate_documents = candidate_documents
+        self.documents: Dict[str, Document] = {}
+        self.names: Dict[str, str] = {}
+        self.retrievers: Dict = {}
+        # term -> {document key: chunks of the document containing the term}
+        self.postings: Dict[str, Dict[str, int]] = {}
+        # Term counts of added documents not merged into postings yet
+        self._pending: Dict[str, Dict[str, int]] = {}
+        self.chunk_count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.documents
+
+    def add(self, document: Document, name: str, retriever=None) -> None:
+        """Add a document (a no-op if it is already in the library) with its retriever, built if not given"""
+        if document.key in self.documents:
+            return
+        if retriever is None:
+            retriever = self.make_retriever(document.index)
+        if isinstance(retriever, BM25Index):
+            frequencies = retriever.document_frequencies()
+        else:
+            frequencies = Counter()
+            for chunk in document.index:
+                frequencies.update(set(tokenize(chunk['text'])))
+        with self._lock:
+            self.documents[document.key] = document
+            self.names[document.key] = name
+            self.retrievers[document.key] = retriever
+            self.chunk_count += len(document.index)
+            self._pending[document.key] = frequencies
+
+    def _merge_pending(self) -> None:
+        for key, frequencies in self._pending.items():
+            for term, count in frequencies.items():
+                self.postings.setdefault(term, {})[key] = count
+        self._pending.clear()
+
+    def remove(self, key: str) -> None:
+        with self._lock:
+            document = self.documents.pop(key, None)
+            if document is None:
+                return
+            del self.names[key]
+            del self.retrievers[key]
+            self.chunk_count -= len(document.index)
+            if self._pending.pop(key, None) is not None:
+                return
+            for term in list(self.postings):
+                documents = self.postings[term]
+                documents.pop(key, None)
+                if not documents:
+                    del self.postings[term]
+
+    def idf(self, term: str) -> float:
+        """BM25 IDF of a term over the chunks of every document in the library (call with the lock held)"""
+        df = sum(self.postings.get(term, {}).values())
+        return math.log((self.chunk_count - df + 0.5) / (df + 0.5) + 1)
+
+    def candidates(self, query: str,
+                   keys: Optional[Collection[str]] = None) -> Tuple[List[str], Dict[str, float]]:
+        """
+        Choose the documents to search for a query
+
+        Returns:
+            Keys of the documents (only among keys if given), most promising first,
+            and the library IDF of every query term, taken under the lock so the
+            search threads never read the postings while documents are merged in
+        """
+        scores: Dict[str, float] = {}
+        weights: Dict[str, float] = {}
+        with self._lock:
+            self._merge_pending()
+            for term in set(tokenize(query)):
+                idf = weights[term] = self.idf(term)
+                for key, count in self.postings.get(term, {}).items():
+                    if keys is not None and key not in keys:
+                        continue
+                    scores[key] = scores.get(key, 0.0) + idf * math.log1p(count)
+        return heapq.nlargest(self.candidate_documents, scores, key=scores.get), weights
+
+    @staticmethod
+    def _search_document(key: str, retriever, query: str, top_k: int, min_score: float,
+                         weights: Dict[str, float]) -> List[Hit]:
+        if isinstance(retriever, BM25Index):
+            hits = retriever.search(query, top_k=top_k, min_score=min_score,
+                                    idf=lambda term: weights.get(term, 0.0))
+        else:
+            hits = retriever.search(query, top_k=top_k, min_score=min_score)
+        return [(key, chunk_id, score) for chunk_id, score in hits]
+
+    def search(self, query: str, top_k: int = TOP_K, min_score: float = MIN_SCORE,
+               per_document: int = PER_DOCUMENT_TOP_K, keys: Optional[Collection[str]] = None) -> List[Hit]:
+        """
+        Search the candidate documents in parallel and merge their hits
+
+        Args:
+            per_document: Hits taken from each searched document
+            keys: Documents to search (the whole library by default)
+
+        Returns:
+            Up to top_k (document key, chunk id, score) hits across the library, best first
+        """
+        with span("library.select"):
+            keys, weights = self.candidates(query, keys)
+            with self._lock:
+                retrievers = [(key, self.retrievers[key]) for key in keys if key in self.retrievers]
+        if not retrievers:
+            return []
+        with span("library.search"):
+            futures = [_executor.submit(self._search_document, key, retriever, query, per_document,
+                                        min_score, weights)
+                       for key, retriever in retrievers]
+            hits = [hit for future in futures for hit in future.result()]
+        return heapq.nlargest(top_k, hits, key=lambda hit: hit[2])
+
+    def citation(self, key: str, start: int, end: int) -> Dict:
+        """Where a span of a document comes from (down to its pages, if known), with a short excerpt around it"""
+        document = self.documents[key]
+        return {
+            'document': key,
+            'name': self.names[key],
+            'start': start,
+            'end': end,
+            'pages': document.pages((start, end)),
+            'excerpt': document.excerpt((start, end))
+        }
+
+    def stats(self) -> List[Dict]:
+        """Name, key, words and chunks of every document"""
+        return [
+            {'document': key, 'name': self.names[key],
+             'words': document.word_count, 'chunks': len(document.index)}
+            for key, document in self.documents.items()
+        ]
+
+
+def ask_library(library: DocumentLibrary, question: str, top_k: int = TOP_K,
+                min_score: float = MIN_SCORE, ollama=None,
+                keys: Optional[Collection[str]] = None) -> Dict:
+    """
+    Answer a question from the documents of a library
+
+    The global top_k chunks are read by the extractive QA model, or packed, best
+    first, into the context window of ollama (an OllamaQA) if given. Answers cite
+    the document and span they come from: 'source' is the citation of the
+    extractive answer and 'citations' lists every span the model read. keys
+    limits the question to some documents.
+    """
+    if not len(library):
+        return {
+            'answer': "The library is empty.",
+            'confidence': 0,
+            'context': "",
+            'highlight': "",
+            'citations': []
+        }
+
+    try:
+        with span("library.retrieval") as retrieval:
+            hits = library.search(question, top_k=top_k, min_score=min_score, keys=keys)
+        if not hits:
+            return {
+                'answer': NO_ANSWER,
+                'confidence': 0,
+                'context': "No specific context found.",
+                'highlight': "",
+                'citations': [],
+                'timings': {'retrieval': retrieval.seconds}
+            }
+
+        if ollama is not None:
+            with span("library.context"):
+                context, citations = _library_context(library, hits, ollama, question)
+            with span("library.inference") as inference:
+                result = ollama.ask_with_context(context, question)
+            result['citations'] = citations
+            result['timings'] = {'retrieval': retrieval.seconds, 'inference': inference.seconds}
+            return result
+
+        citations = []
+        for key, chunk_id, score in hits:
+            start, end = library.documents[key].index.span(chunk_id)
+            citation = library.citation(key, start, end)
+            citation['score'] = round(score, 3)
+            citations.append(citation)
+
+        with span("library.inference") as inference:
+            chunks = [library.documents[key].index.chunk(chunk_id) for key, chunk_id, _ in hits]
+            results = run_qa(question, chunks)
+
+        best = None
+        for (key, _, _), chunk, result in zip(hits, chunks, results):
+            if result is not None and (best is None or result['score'] > best[2]['score']):
+                best = (key, chunk, result)
+        if best is None:
+            return {
+                'answer': NO_ANSWER,
+                'confidence': 0,
+                'context': "No specific context found.",
+                'highlight': "",
+                'citations': citations,
+                'timings': {'retrieval': retrieval.seconds, 'inference': inference.seconds}
+            }
+
+        key, chunk, result = best
+        document = library.documents[key]
+        start = chunk['start'] + result['start']
+        end = chunk['start'] + result['end']
+        return {
+            'answer': result['answer'],
+            'confidence': round(result['score'] * 100, 1),
+            'context': highlight_text(document.text, start, end, index=document.index,
+                                      offsets=document.offsets),
+            'highlight': result['answer'],
+            'full_context': chunk['text'],
+            'answer_span': (start, end),
+            'context_span': (chunk['start'], chunk['end']),
+            'pages': document.pages((start, end)),
+            'source': library.citation(key, start, end),
+            'citations': citations,
+            'timings': {'retrieval': retrieval.seconds, 'inference': inference.seconds}
+        }
+
+    except Exception as e:
+        print(f"Error in ask_library: {str(e)}")
+        return {
+            'answer': f"Error processing your question: {str(e)}",
+            'confidence': 0,
+            'context': "An error occurred while searching the library.",
+            'highlight': "",
+            'citations': [],
+            'error': True
+        }
+
+
+def _library_context(library: DocumentLibrary, hits: List[Hit], ollama,
+                     question: str) -> Tuple[str, List[Dict]]:
+    """
+    Pack the hits into ollama's context window, grouped by document
+
+    Each group is headed by the document's name. Returns the context and the
+    citations of the spans it contains, scored by the best hit they include.
+    """
+    def header(key: str) -> str:
+        return f"[Source: {library.names[key]}]\n"
+
+    packed = ollama.pack_chunks(
+        question, [(key, library.documents[key].index, chunk_id) for key, chunk_id, _ in hits], header=header
+    )
+    context = "\n\n".join(
+        header(key) + "\n\n".join(library.documents[key].slice(span) for span in spans)
+        for key, spans in packed.items()
+    )
+    citations = []
+    for key, spans in packed.items():
+        index = library.documents[key].index
+        for start, end in spans:
+            citation = library.citation(key, start, end)
+            citation['score'] = round(max(
+                score for hit_key, chunk_id, score in hits
+                if hit_key == key and index.span(chunk_id)[0] < end and index.span(chunk_id)[1] > start
+            ), 3)
+            citations.append(citation)
+    return context, citations
@@ -0,0 +1,140 @@
+from typing import Any, Callable, Dict, Optional
+import gc
+import os
+import threading
+import time
+from inference_backends import build_pipeline
+
+QA_MODEL = "distilbert-base-cased-distilled-squad"
+GENERATOR_MODEL = "gpt2"
+SUMMARIZER_MODEL = "facebook/bart-large-cnn"
+
+# Pipeline task and model of the registry entries that can switch inference backend
+MODEL_TASKS = {
+    'qa': ("question-answering", QA_MODEL),
+    'summarizer': ("summarization", SUMMARIZER_MODEL)
+}
+# 'torch', 'int8' or 'onnx' (see inference_backends.py)
+MODEL_BACKENDS = {
+    'qa': os.environ.get("QA_BACKEND", "torch"),
+    'summarizer': os.environ.get("SUMMARIZER_BACKEND", "torch")
+}
+
+
+def _model_memory(obj: Any) -> int:
+    """Bytes held by the tensors of a pipeline's (or embedder's) torch model (0 for ONNX Runtime)"""
+    model = getattr(obj, 'model', obj)
+    try:
+        state = model.state_dict()
+    except AttributeError:
+        return 0
+    # Dynamically quantized layers keep their int8 weights in packed (weight, bias) tuples
+    tensors = []
+    for value in state.values():
+        tensors.extend(value if isinstance(value, tuple) else [value])
+    return sum(t.numel() * t.element_size() for t in tensors if hasattr(t, 'element_size'))
+
+
+class ModelRegistry:
+    """
+    Process-wide registry that loads each model once, on first use.
+
+    Streamlit reruns the app script but imports modules only once per process,
+    so a module-level registry is shared by every session. Loading is guarded
+    by a lock per model: concurrent first requests for the same model wait for
+    a single load, while different models can load in parallel.
+    """
+
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._models: Dict[str, Any] = {}
+        self._stats: Dict[str, Dict] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory: Callable[[], Any]) -> None:
+        with self._lock:
+            self._factories[name] = factory
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str) -> Any:
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._factories:
+            raise KeyError(f"Unknown model: {name}")
+        with self._locks[name]:
+            model = self._models.get(name)
+            if model is None:
+                start = time.perf_counter()
+                model = self._factories[name]()
+                self._stats[name] = {
+                    'load_time': time.perf_counter() - start,
+                    'memory_bytes': _model_memory(model),
+                    # Differs from MODEL_BACKENDS if verification fell back to fp32
+                    'backend': getattr(model, 'inference_backend', MODEL_BACKENDS.get(name, 'torch'))
+                }
+                self._models[name] = model
+        return model
+
+    def peek(self, name: str) -> Optional[Any]:
+        """The model if it is already loaded, without loading it"""
+        return self._models.get(name)
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def preload(self, *names: str) -> None:
+        for name in names or list(self._factories):
+            self.get(name)
+
+    def unload(self, *names: str) -> None:
+        for name in names or list(self._factories):
+            with self._locks[name]:
+                self._models.pop(name, None)
+                self._stats.pop(name, None)
+        gc.collect()
+
+    def stats(self) -> Dict[str, Dict]:
+        """Load state, backend (as loaded, else as configured), load time (seconds) and parameter memory (bytes) of every registered model"""
+        report = {}
+        for name in self._factories:
+            stats = self._stats.get(name, {})
+            report[name] = {
+                'loaded': name in self._models,
+                'backend': stats.get('backend', MODEL_BACKENDS.get(name, 'torch')),
+                'load_time': stats.get('load_time'),
+                'memory_bytes': stats.get('memory_bytes')
+            }
+        return report
+
+
+def _qa_pipeline():
+    return build_pipeline("question-answering", QA_MODEL, MODEL_BACKENDS['qa'])
+
+
+def _generator():
+    from transformers import pipeline
+    generator = pipeline("text-generation", model=GENERATOR_MODEL, device=-1)
+    # GPT-2 has no padding token; batched prompts are left-padded with EOS
+    generator.tokenizer.pad_token_id = generator.model.config.eos_token_id
+    generator.tokenizer.padding_side = "left"
+    return generator
+
+
+def _summarizer():
+    return build_pipeline("summarization", SUMMARIZER_MODEL, MODEL_BACKENDS['summarizer'])
+
+
+def _embedder():
+    from retrieval import TransformerEmbedder
+    embedder = TransformerEmbedder()
+    embedder.load()
+    return embedder
+
+
+registry = ModelRegistry()
+registry.register('qa', _qa_pipeline)
+registry.register('generator', _generator)
+registry.register('summarizer', _summarizer)
+registry.register('embedder', _embedder)
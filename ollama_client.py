@@ -0,0 +1,160 @@
+from typing import AsyncIterator, Dict, Iterator, List, Optional
+import asyncio
+import json
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 300.0
+MAX_CONCURRENCY = 4
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+RETRY_STATUS = frozenset({429, 502, 503, 504})
+
+
+class OllamaError(Exception):
+    pass
+
+
+class OllamaClient:
+    """
+    HTTP client for a local Ollama server.
+
+    All requests share one pooled requests.Session, so concurrent questions
+    reuse keep-alive connections instead of queueing behind each other. A
+    semaphore bounds how many requests are in flight, connection failures,
+    timeouts and 429/502/503/504 responses are retried with exponential
+    backoff, and the a* methods run requests off the asyncio event loop.
+
+    Args:
+        host: Base URL of the Ollama server
+        connect_timeout: Seconds to wait for a connection
+        read_timeout: Seconds to wait between bytes of a response
+        max_concurrency: Maximum requests in flight
+        max_retries: Retries after the first attempt for transient errors
+        backoff: Delay before the first retry, doubled on every retry
+    """
+
+    def __init__(self, host: str = OLLAMA_HOST, connect_timeout: float = CONNECT_TIMEOUT,
+                 read_timeout: float = READ_TIMEOUT, max_concurrency: int = MAX_CONCURRENCY,
+                 max_retries: int = MAX_RETRIES, backoff: float = RETRY_BACKOFF):
+        self.host = host.rstrip('/')
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _request(self, method: str, path: str, payload: Optional[Dict] = None, stream: bool = False,
+                 timeout=None, retries: Optional[int] = None) -> requests.Response:
+        retries = self.max_retries if retries is None else retries
+        url = f"{self.host}{path}"
+        for attempt in range(retries + 1):
+            try:
+                response = self.session.request(method, url, json=payload, stream=stream,
+                                                timeout=timeout or self.timeout)
+                if response.status_code in RETRY_STATUS and attempt < retries:
+                    response.close()
+                else:
+                    if response.status_code >= 400:
+                        message = response.text
+                        response.close()
+                        raise OllamaError(f"Ollama returned {response.status_code}: {message}")
+                    return response
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= retries:
+                    raise OllamaError(f"Could not reach Ollama at {self.host}: {e}") from e
+            time.sleep(self.backoff * 2 ** attempt)
+        raise OllamaError(f"Ollama request to {path} failed")
+
+    def is_available(self, timeout: float = 5) -> bool:
+        """Health probe: whether the server answers, without retries"""
+        try:
+            self._request('GET', '/api/tags', timeout=timeout, retries=0).close()
+            return True
+        except OllamaError:
+            return False
+
+    def list_models(self) -> List[str]:
+        with self._slots:
+            response = self._request('GET', '/api/tags')
+        return [model['name'] for model in response.json().get('models', [])]
+
+    def pull(self, model: str) -> None:
+        with self._slots:
+            self._request('POST', '/api/pull', {'model': model, 'stream': False}, timeout=(self.timeout[0], None))
+
+    def generate(self, model: str, prompt: str, options: Optional[Dict] = None,
+                 system: Optional[str] = None) -> Dict:
+        """Complete a prompt and return Ollama's final response object"""
+        payload = {'model': model, 'prompt': prompt, 'stream': False, 'options': options or {}}
+        if system:
+            payload['system'] = system
+        with self._slots:
+            response = self._request('POST', '/api/generate', payload)
+        return response.json()
+
+    def generate_stream(self, model: str, prompt: str, options: Optional[Dict] = None,
+                        system: Optional[str] = None) -> Iterator[Dict]:
+        """Complete a prompt, yielding Ollama's response objects as tokens are generated"""
+        payload = {'model': model, 'prompt': prompt, 'stream': True, 'options': options or {}}
+        if system:
+            payload['system'] = system
+        with self._slots:
+            response = self._request('POST', '/api/generate', payload, stream=True)
+            with response:
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    part = json.loads(line)
+                    if 'error' in part:
+                        raise OllamaError(part['error'])
+                    yield part
+                    if part.get('done'):
+                        break
+
+    async def ais_available(self, timeout: float = 5) -> bool:
+        return await asyncio.to_thread(self.is_available, timeout)
+
+    async def agenerate(self, model: str, prompt: str, options: Optional[Dict] = None,
+                        system: Optional[str] = None) -> Dict:
+        return await asyncio.to_thread(self.generate, model, prompt, options, system)
+
+    async def agenerate_stream(self, model: str, prompt: str, options: Optional[Dict] = None,
+                               system: Optional[str] = None) -> AsyncIterator[Dict]:
+        """generate_stream for asyncio: each response object is read in a worker thread"""
+        stream = self.generate_stream(model, prompt, options, system)
+        end = object()
+        try:
+            while True:
+                part = await asyncio.to_thread(next, stream, end)
+                if part is end:
+                    break
+                yield part
+        finally:
+            # Releases the connection and the concurrency slot if the caller stops early
+            await asyncio.to_thread(stream.close)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_default_client: Optional[OllamaClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> OllamaClient:
+    """The process-wide client for OLLAMA_HOST"""
+    global _default_client
+    with _client_lock:
+        if _default_client is None:
+            _default_client = OllamaClient()
+        return _default_client
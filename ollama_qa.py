@@ -1,15 +1,39 @@
-import ollama
-from typing import Dict, Optional
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
 import re
+from chunking import ChunkIndex, approx_token_count
+from ollama_client import OllamaClient, get_client
+from retrieval import BM25Index, retrieve_chunks, TOP_K, MIN_SCORE
+from tracing import tracer
+
+ANSWER_TOKENS = 512
+RAG_CANDIDATES = 20
+MIN_PARTIAL_TOKENS = 64
+# Server-side durations (nanoseconds) in Ollama's final response, recorded as stages
+OLLAMA_STAGES = {
+    'load_duration': "ollama.load",
+    'prompt_eval_duration': "ollama.prefill",
+    'eval_duration': "ollama.decode"
+}
 
 class OllamaQA:
-    def __init__(self, model_name: str = "llama3:instruct"):
+    def __init__(self, model_name: str = "llama3:instruct", client: Optional[OllamaClient] = None,
+                 rag: bool = False, answer_tokens: int = ANSWER_TOKENS,
+                 token_counter: Callable[[str], int] = approx_token_count):
         """
         Initialize the Ollama QA model
         Args:
             model_name: Name of the Ollama model to use (e.g., 'llama3:instruct', 'mistral')
+            client: Ollama client to use (defaults to the shared client for OLLAMA_HOST)
+            rag: Pack the most relevant chunks into the context window instead of
+                sending the whole document
+            answer_tokens: Tokens of the context window reserved for the answer in RAG mode
+            token_counter: Token count of a string, used to budget the context window
         """
         self.model_name = model_name
+        self.client = client or get_client()
+        self.rag = rag
+        self.answer_tokens = answer_tokens
+        self.token_counter = token_counter
         self.system_prompt = """You are a helpful AI assistant that provides accurate, detailed answers based on the given context. 
         Follow these guidelines:
         1. Answer the question using only the information from the provided context
@@ -17,6 +41,13 @@ class OllamaQA:
         3. If the context doesn't contain enough information, say so
         4. Format your response in clear, readable markdown
         """
+        self.options = {
+            'temperature': 0.2,
+            'top_p': 0.9,
+            'num_ctx': 4096
+        }
+        if rag:
+            self.options['num_predict'] = answer_tokens
     
     def _extract_answer_from_response(self, response: str) -> str:
         """Clean and format the model's response"""
@@ -25,20 +56,120 @@ class OllamaQA:
         response = re.sub(r'^Answer:', '', response).strip()
         return response
     
-    def ask_question(self, context: str, question: str) -> Dict:
+    def _context_budget(self, question: str) -> int:
+        """Tokens left for document context once the prompt and answer are accounted for"""
+        overhead = self.token_counter(self._build_prompt("", question))
+        return self.options['num_ctx'] - overhead - self.answer_tokens
+    
+    def pack_chunks(self, question: str, chunks: Iterable[Tuple[Hashable, ChunkIndex, int]],
+                    header: Optional[Callable[[Hashable], str]] = None) -> Dict[Hashable, List[Tuple[int, int]]]:
         """
-        Ask a question about the given context using Ollama
+        Pack chunks into the context window
+        
+        Chunks are taken in order while they fit the token budget (num_ctx minus
+        the prompt and the tokens reserved for the answer). Overlapping chunks of
+        the same text are merged so no text is sent twice, and the first chunk
+        that does not fit is cut at a word boundary if enough budget remains.
         
         Args:
-            context: The document or text to answer questions about
-            question: The question to answer
-            
+            question: The question the context is for
+            chunks: (key, ChunkIndex, chunk id) triples, most relevant first; chunks
+                with the same key come from the same text
+            header: Text sent before the spans of each key (e.g. a document's name),
+                counted against the budget
+        
         Returns:
-            Dict containing the answer and metadata
+            The (start, end) spans packed for each key, in document order, keys in the order they were first packed
         """
-        try:
-            
-            prompt = f"""You are a helpful AI assistant. Answer the following question based on the provided context.
+        budget = self._context_budget(question)
+        spans: Dict[Hashable, List[Tuple[int, int]]] = {}
+        texts: Dict[Hashable, str] = {}
+        
+        def cost(candidate_spans):
+            tokens = 0
+            for key, key_spans in candidate_spans.items():
+                if header is not None:
+                    tokens += self.token_counter(header(key))
+                text = texts[key]
+                tokens += sum(self.token_counter(text[start:end]) for start, end in _merge_spans(key_spans))
+            return tokens
+        
+        def adding(key, span):
+            return {**spans, key: spans.get(key, []) + [span]}
+        
+        for key, index, chunk_id in chunks:
+            texts[key] = index.text
+            span = index.span(chunk_id)
+            if cost(adding(key, span)) <= budget:
+                spans = adding(key, span)
+                continue
+            remaining = budget - cost(spans)
+            if remaining >= MIN_PARTIAL_TOKENS:
+                # Binary search the number of leading words of the chunk that fit
+                first, last = index.bounds[chunk_id]
+                lo, hi = 0, last - first
+                while lo < hi:
+                    mid = (lo + hi + 1) // 2
+                    if cost(adding(key, (index.word_starts[first], index.word_ends[first + mid - 1]))) <= budget:
+                        lo = mid
+                    else:
+                        hi = mid - 1
+                if lo:
+                    spans = adding(key, (int(index.word_starts[first]), int(index.word_ends[first + lo - 1])))
+            break
+        
+        return {key: _merge_spans(key_spans) for key, key_spans in spans.items()}
+    
+    def pack_context(self, question: str, retriever, min_score: float = MIN_SCORE,
+                     candidates: int = RAG_CANDIDATES) -> Tuple[str, List[Tuple[int, int]]]:
+        """
+        Pack the chunks most relevant to a question into the context window (see pack_chunks)
+        
+        When retrieval finds nothing (e.g. "Summarize it"), the leading chunks of
+        the document are packed instead, so the model never gets an empty context.
+        
+        Returns:
+            The packed context and the (start, end) document spans it contains, in document order
+        """
+        index = retriever.chunk_index
+        chunk_ids = [chunk_id for chunk_id, _ in retriever.search(question, top_k=candidates, min_score=min_score)]
+        if not chunk_ids:
+            chunk_ids = range(len(index))
+        spans = self.pack_chunks(question, ((None, index, chunk_id) for chunk_id in chunk_ids)).get(None, [])
+        return "\n\n".join(index.text[start:end] for start, end in spans), spans
+    
+    def build_context(self, context: str, question: str, retriever=None, top_k: int = TOP_K,
+                      min_score: float = MIN_SCORE) -> Tuple[str, List[Tuple[int, int]]]:
+        """
+        Choose what to send to the model as context
+        
+        In RAG mode the relevant chunks are packed into the token budget (a BM25
+        index over the context is built if no retriever is given). Otherwise a
+        retriever narrows the context to its top_k chunks, and without one the
+        whole context is used.
+        
+        Returns:
+            The context and the (start, end) spans of the document it covers
+        """
+        if self.rag:
+            if retriever is None:
+                retriever = BM25Index(ChunkIndex(context))
+            return self.pack_context(question, retriever, min_score=min_score)
+        if retriever is not None:
+            chunk_ids = retrieve_chunks(retriever, question, top_k=top_k, min_score=min_score)
+            if chunk_ids is not None:
+                spans = [retriever.chunk_index.span(i) for i in chunk_ids]
+                return "\n\n".join(retriever.chunk_index.chunk_text(i) for i in chunk_ids), spans
+        return context, [(0, len(context))]
+    
+    def _record_timings(self, response: Dict) -> None:
+        """Record the model load, prefill and decode times Ollama reports with a finished response"""
+        for field, stage in OLLAMA_STAGES.items():
+            if response.get(field):
+                tracer.record(stage, response[field] / 1e9)
+    
+    def _build_prompt(self, context: str, question: str) -> str:
+        return f"""You are a helpful AI assistant. Answer the following question based on the provided context.
             
             Context:
             {context}
@@ -47,17 +178,66 @@ class OllamaQA:
             
             Provide a detailed and accurate answer. If the context doesn't contain enough information, say so.
             Answer: """
-            
-            
-            response = ollama.generate(
+    
+    def stream_with_context(self, context: str, question: str, raise_errors: bool = False) -> Iterator[str]:
+        """
+        Stream the answer to a question using context as is (e.g. from build_context)
+        
+        Errors are yielded as an error message unless raise_errors is set.
+        """
+        try:
+            stream = self.client.generate_stream(
                 model=self.model_name,
-                prompt=prompt,
-                options={
-                    'temperature': 0.2,
-                    'top_p': 0.9,
-                    'num_ctx': 4096
-                }
+                prompt=self._build_prompt(context, question),
+                options=self.options
             )
+            for part in stream:
+                if part['response']:
+                    yield part['response']
+                if part.get('done'):
+                    self._record_timings(part)
+        except Exception as e:
+            if raise_errors:
+                raise
+            yield f"Error getting response from Ollama: {str(e)}\n\nMake sure Ollama is running and the model is downloaded."
+    
+    def ask_question(self, context: str, question: str, retriever=None,
+                     top_k: int = TOP_K, min_score: float = MIN_SCORE) -> Dict:
+        """
+        Ask a question about the given context using Ollama
+        
+        Args:
+            context: The document or text to answer questions about
+            question: The question to answer
+            retriever: Optional BM25Index or EmbeddingIndex over the document; when
+                given, only the top_k retrieved chunks are sent to the model
+            top_k: Number of chunks to retrieve
+            min_score: Minimum retrieval score for a chunk to be used
+            
+        Returns:
+            Dict containing the answer and metadata
+        """
+        try:
+            with tracer.span("ollama.context"):
+                context, spans = self.build_context(context, question, retriever, top_k, min_score)
+        except Exception as e:
+            return self._error_result(e)
+        result = self.ask_with_context(context, question)
+        result['sources'] = spans if not result.get('error') else []
+        return result
+    
+    def ask_with_context(self, context: str, question: str) -> Dict:
+        """Ask a question using context as is (e.g. from build_context or a document library)"""
+        try:
+            prompt = self._build_prompt(context, question)
+            
+            with tracer.span("ollama.generate"):
+                response = self.client.generate(
+                    model=self.model_name,
+                    prompt=prompt,
+                    options=self.options
+                )
+            self._record_timings(response)
             
          
             answer = response['response'].strip()
@@ -72,18 +252,34 @@ class OllamaQA:
                 'highlight': answer[:200],
                 'confidence': 90.0 if answer else 0,
                 'is_comprehensive': True,
-                'model': self.model_name
+                'model': self.model_name,
+                'sources': [(0, len(context))]
             }
             
         except Exception as e:
-            return {
-                'answer': f"Error getting response from Ollama: {str(e)}\n\nMake sure Ollama is running and the model is downloaded.",
-                'context': "",
-                'highlight': "",
-                'confidence': 0,
-                'is_comprehensive': False,
-                'model': self.model_name
-            }
+            return self._error_result(e)
+    
+    def _error_result(self, error: Exception) -> Dict:
+        return {
+            'answer': f"Error getting response from Ollama: {str(error)}\n\nMake sure Ollama is running and the model is downloaded.",
+            'context': "",
+            'highlight': "",
+            'confidence': 0,
+            'is_comprehensive': False,
+            'model': self.model_name,
+            'sources': [],
+            'error': True
+        }
+
+def _merge_spans(spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Sort spans and merge the ones that overlap or touch"""
+    merged: List[Tuple[int, int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+from concurrent.futures import Future
+from typing import Callable, Dict, List, Optional, Tuple
+import queue
+import threading
+import time
+from model_registry import registry
+from question_answering import run_qa_pairs
+
+MAX_BATCH = 16
+MAX_WAIT_MS = 5.0
+
+
+class QABatchScheduler:
+    """
+    Dynamic micro-batching in front of the extractive QA model.
+
+    Callers from any thread submit (question, context) pairs and get a Future
+    back. A single worker thread takes the first waiting pair, keeps collecting
+    pairs for up to max_wait_ms or until max_batch pairs are queued, and runs
+    them through the model as one batch with run_qa_pairs. Raising max_wait_ms
+    and max_batch trades latency for throughput under concurrent load.
+
+    Args:
+        max_batch: Largest number of pairs per forward batch
+        max_wait_ms: How long the first pair of a batch waits for company
+        pipe_factory: Returns the QA pipeline (defaults to the registry's 'qa' model)
+    """
+
+    def __init__(self, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS,
+                 pipe_factory: Optional[Callable] = None):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.pipe_factory = pipe_factory or (lambda: registry.get('qa'))
+        self._queue: "queue.Queue[Optional[Tuple[str, str, Future, float]]]" = queue.Queue()
+        self._metrics_lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._max_batch_seen = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._closed = False
+        self._worker = threading.Thread(target=self._loop, name="qa-batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, question: str, context: str) -> Future:
+        if self._closed:
+            raise RuntimeError("QABatchScheduler is closed")
+        future: Future = Future()
+        self._queue.put((question, context, future, time.perf_counter()))
+        return future
+
+    def run(self, question: str, chunks: List[Dict]) -> List[Optional[Dict]]:
+        """Answer question over chunks; same contract as question_answering.run_qa_batched"""
+        futures = [self.submit(question, chunk['text']) for chunk in chunks]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print(f"Error processing chunk: {e}")
+                results.append(None)
+        return results
+
+    def _collect(self) -> List[Tuple[str, str, Future, float]]:
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Re-post the shutdown marker for the outer loop after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._collect()
+            if not batch:
+                return
+            started = time.perf_counter()
+            waits = [started - enqueued for _, _, _, enqueued in batch]
+            try:
+                results = run_qa_pairs(
+                    self.pipe_factory(),
+                    [(question, context) for question, context, _, _ in batch],
+                    batch_size=len(batch)
+                )
+                for (_, _, future, _), result in zip(batch, results):
+                    if result is None:
+                        future.set_exception(RuntimeError("QA inference failed for this chunk"))
+                    else:
+                        future.set_result(result)
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+            self._record(len(batch), waits)
+
+    def _record(self, size: int, waits: List[float]) -> None:
+        with self._metrics_lock:
+            self._batches += 1
+            self._items += size
+            self._max_batch_seen = max(self._max_batch_seen, size)
+            self._total_wait += sum(waits)
+            self._max_wait_seen = max(self._max_wait_seen, max(waits))
+
+    def metrics(self) -> Dict:
+        """Queue depth, batch sizes and queueing delay (seconds) so far"""
+        with self._metrics_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'batches': self._batches,
+                'items': self._items,
+                'mean_batch_size': self._items / self._batches if self._batches else 0.0,
+                'max_batch_size': self._max_batch_seen,
+                'mean_wait': self._total_wait / self._items if self._items else 0.0,
+                'max_wait': self._max_wait_seen
+            }
+
+    def close(self) -> None:
+        """Stop the worker once the queued pairs are done"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join()
@@ -1,31 +1,80 @@
-from transformers import pipeline
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import re
+from chunking import ChunkIndex, CHUNK_SIZE, CHUNK_OVERLAP
+from retrieval import retrieve_chunks, TOP_K, MIN_SCORE
+from model_registry import registry
+from tracing import span
+from utils import OffsetMap, page_label
 
-qa_pipeline = pipeline(
-    "question-answering",
-    model="distilbert-base-cased-distilled-squad",
-    device=-1
-)
+def extract_context(document_text: str, chunk_size: int = CHUNK_SIZE,
+                    overlap: int = CHUNK_OVERLAP) -> List[Dict]:
+    return ChunkIndex(document_text, chunk_size=chunk_size, overlap=overlap).chunks()
 
-def extract_context(document_text: str, max_chars: int = 4000) -> List[Dict]:
-    words = document_text.split()
-    chunks = []
-    chunk_size = 1000  
-    overlap = 200      
+QA_BATCH_SIZE = 8
+QA_PARAMS = {
+    'max_answer_len': 150,
+    'max_question_len': 100,
+    'max_seq_len': 512
+}
+
+def run_qa_pairs(pipe, pairs: List[Tuple[str, str]],
+                 batch_size: int = QA_BATCH_SIZE) -> List[Optional[Dict]]:
+    """
+    Run a question-answering pipeline over many (question, context) pairs in batches.
+
+    Pairs are sorted by context length before batching so each batch pads to a
+    similar sequence length. If a batch fails, its pairs are retried one by one
+    so a single bad chunk only loses its own result.
+
+    Returns:
+        One pipeline result per pair, in input order (None for failed pairs)
+    """
+    results: List[Optional[Dict]] = [None] * len(pairs)
+    order = sorted(range(len(pairs)), key=lambda i: len(pairs[i][1]))
     
-    for i in range(0, len(words), chunk_size - overlap):
-        chunk = ' '.join(words[i:i + chunk_size])
-        chunks.append({
-            'text': chunk,
-            'start': sum(len(w) + 1 for w in words[:i]),
-            'end': sum(len(w) + 1 for w in words[:i + len(chunk.split())])
-        })
+    for b in range(0, len(order), batch_size):
+        batch = order[b:b + batch_size]
+        inputs = [{'question': pairs[i][0], 'context': pairs[i][1]} for i in batch]
+        try:
+            with span("qa.forward"):
+                outputs = pipe(inputs, batch_size=len(batch), **QA_PARAMS)
+            if isinstance(outputs, dict):
+                outputs = [outputs]
+            for i, output in zip(batch, outputs):
+                results[i] = output
+        except Exception as e:
+            print(f"Error processing batch, retrying chunks individually: {e}")
+            for i in batch:
+                try:
+                    results[i] = pipe(question=pairs[i][0], context=pairs[i][1], **QA_PARAMS)
+                except Exception as chunk_error:
+                    print(f"Error processing chunk: {chunk_error}")
     
-    return chunks
+    return results
 
-def find_best_answer(document_text: str, question: str) -> Dict:
-    chunks = extract_context(document_text)
+def run_qa_batched(pipe, question: str, chunks: List[Dict],
+                   batch_size: int = QA_BATCH_SIZE) -> List[Optional[Dict]]:
+    """Run a question-answering pipeline for one question over many chunks in batches"""
+    return run_qa_pairs(pipe, [(question, chunk['text']) for chunk in chunks], batch_size=batch_size)
+
+_qa_scheduler = None
+
+def set_qa_scheduler(scheduler) -> None:
+    """Route QA inference through a QABatchScheduler (None to run it in the calling thread)"""
+    global _qa_scheduler
+    _qa_scheduler = scheduler
+
+def run_qa(question: str, chunks: List[Dict], batch_size: int = QA_BATCH_SIZE) -> List[Optional[Dict]]:
+    """Run the shared QA model over chunks, through the micro-batching scheduler if one is set"""
+    if _qa_scheduler is not None:
+        return _qa_scheduler.run(question, chunks)
+    return run_qa_batched(registry.get('qa'), question, chunks, batch_size=batch_size)
+
+def find_best_answer(document_text: str, question: str, index: Optional[ChunkIndex] = None,
+                     batch_size: int = QA_BATCH_SIZE, candidates: Optional[List[int]] = None) -> Dict:
+    if index is None:
+        with span("qa.chunking"):
+            index = ChunkIndex(document_text)
     best_score = 0
     best_answer = {
         'answer': "I couldn't find a clear answer in the document.",
@@ -35,32 +84,38 @@ def find_best_answer(document_text: str, question: str) -> Dict:
         'context': ""
     }
     
-    for chunk in chunks:
-        try:
-            result = qa_pipeline(
-                question=question,
-                context=chunk['text'],
-                max_answer_len=150,
-                max_question_len=100,
-                max_seq_len=512
-            )
-            
+    if candidates is None:
+        chunks = index.chunks()
+    else:
+        chunks = [index.chunk(i) for i in candidates]
+    results = run_qa(question, chunks, batch_size=batch_size)
+    
+    for chunk, result in zip(chunks, results):
+        if result is None:
+            continue
+        if result['score'] > best_score:
             result['start'] += chunk['start']
             result['end'] += chunk['start']
             result['context'] = chunk['text']
-            
-            if result['score'] > best_score:
-                best_score = result['score']
-                best_answer = result
-        except Exception as e:
-            print(f"Error processing chunk: {e}")
-            continue
+            result['context_start'] = chunk['start']
+            result['context_end'] = chunk['end']
+            best_score = result['score']
+            best_answer = result
     
     return best_answer
 
-def highlight_text(text: str, start: int, end: int, window: int = 100) -> str:
+def highlight_text(text: str, start: int, end: int, window: int = 100,
+                   index: Optional[ChunkIndex] = None, offsets: Optional[OffsetMap] = None) -> str:
+    """
+    The span [start, end) of text with window characters around it
+    
+    With the OffsetMap of text, the excerpt starts with the page(s) of the span.
+    """
+    pages = page_label(offsets.page_numbers(start, end)) if offsets is not None else ""
     start = max(0, start - window)
     end = min(len(text), end + window)
+    if index is not None and index.text is text:
+        start, end = index.snap(start, end)
     
     excerpt = text[start:end]
     
@@ -69,7 +124,8 @@ def highlight_text(text: str, start: int, end: int, window: int = 100) -> str:
     if end < len(text):
         excerpt = excerpt + '...'
     
-    return excerpt.strip()
+    excerpt = excerpt.strip()
+    return f"({pages}) {excerpt}" if pages else excerpt
 
 def get_comprehensive_answer(document_text: str, question: str) -> Dict:
     question_lower = question.lower()
@@ -100,7 +156,9 @@ def get_comprehensive_answer(document_text: str, question: str) -> Dict:
         }
     return None
 
-def ask_question(document_text: str, user_question: str) -> Dict:
+def ask_question(document_text: str, user_question: str, index: Optional[ChunkIndex] = None,
+                 retriever=None, top_k: int = TOP_K, min_score: float = MIN_SCORE,
+                 offsets: Optional[OffsetMap] = None) -> Dict:
     if not document_text.strip():
         return {
             'answer': "No document text provided.",
@@ -116,30 +174,29 @@ def ask_question(document_text: str, user_question: str) -> Dict:
         return comprehensive_answer
     
     try:
-        result = find_best_answer(document_text, user_question)
+        with span("qa.retrieval") as retrieval:
+            candidates = None
+            if retriever is not None:
+                index = retriever.chunk_index
+                candidates = retrieve_chunks(retriever, user_question, top_k=top_k, min_score=min_score)
+        
+        with span("qa.inference") as inference:
+            result = find_best_answer(document_text, user_question, index=index, candidates=candidates)
         
         answer = result.get('answer', "I couldn't find a clear answer in the document.")
         start = result.get('start', 0)
         end = result.get('end', len(answer))
         
         context = result.get('context', '')
-        if not context and 'context' in result:
-            context = result['context']
-            
-        if context:
-            answer_lower = answer.lower()
-            context_lower = context.lower()
-            pos = context_lower.find(answer_lower)
-            
-            if pos >= 0:
-                actual_answer = context[pos:pos+len(answer)]
-                highlighted_context = (
-                    context[:pos] +
-                    f'<span class="highlight">{actual_answer}</span>' +
-                    context[pos+len(actual_answer):]
-                )
-            else:
-                highlighted_context = context
+        
+        if context and 'context_start' in result:
+            # The answer's span is known, so mark it up in place
+            pos = start - result['context_start']
+            highlighted_context = (
+                context[:pos] +
+                f'<span class="highlight">{context[pos:end - result["context_start"]]}</span>' +
+                context[end - result['context_start']:]
+            )
         else:
             highlighted_context = context
         
@@ -148,7 +205,14 @@ def ask_question(document_text: str, user_question: str) -> Dict:
             'confidence': round(result.get('score', 0) * 100, 1),
             'context': highlighted_context or "No specific context found.",
             'highlight': answer,
-            'full_context': context or document_text[:1000]
+            'full_context': context or document_text[:1000],
+            'answer_span': (start, end) if 'context_start' in result else None,
+            'context_span': (result['context_start'], result['context_end']) if 'context_start' in result else None,
+            'pages': offsets.page_numbers(start, end) if offsets is not None and 'context_start' in result else [],
+            'timings': {
+                'retrieval': retrieval.seconds,
+                'inference': inference.seconds
+            }
         }
         
     except Exception as e:
@@ -158,6 +222,7 @@ def ask_question(document_text: str, user_question: str) -> Dict:
             'confidence': 0,
             'context': "An error occurred while processing the document.",
             'highlight': "",
-            'full_context': document_text[:1000]
+            'full_context': document_text[:1000],
+            'error': True
         }
 
@@ -0,0 +1,162 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional
+import threading
+from chunking import ChunkIndex
+from challenge_mode import questions_for_chunks
+from retrieval import TOP_K
+
+BANK_SIZE = 12
+# Chunks per generator call while filling the bank
+FILL_BATCH = 3
+# A draw that leaves fewer ready questions than this starts a refill
+REFILL_BELOW = 6
+
+# Shared by every document and session: generation uses one model, so one worker
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="question-bank")
+
+
+def coverage_order(chunk_count: int) -> List[int]:
+    """
+    All chunk ids, ordered so that every prefix is spread over the whole document
+
+    Chunk k of the order is the chunk at position vdc(k) of the document, where
+    vdc is the base-2 van der Corput sequence (0, 1/2, 1/4, 3/4, 1/8, ...).
+    """
+    order: List[int] = []
+    seen = set()
+    k = 0
+    while len(order) < chunk_count:
+        fraction, denominator, n = 0.0, 1.0, k
+        while n:
+            denominator *= 2
+            fraction += (n & 1) / denominator
+            n >>= 1
+        chunk_id = int(fraction * chunk_count)
+        if chunk_id not in seen:
+            seen.add(chunk_id)
+            order.append(chunk_id)
+        k += 1
+    return order
+
+
+class QuestionBank:
+    """
+    Challenge questions of one document, generated ahead of time in the background.
+
+    fill() queues generation on a shared worker thread; questions come from
+    chunks in coverage_order, so even a partly filled bank covers the whole
+    document, and the order starts over once every chunk has been used. draw()
+    returns ready questions immediately and queues a refill when the bank runs
+    low. The bank holds no reference to the document, so it can be pickled into
+    the index store next to the chunk index.
+
+    Args:
+        chunk_count: Number of chunks in the document's ChunkIndex
+        size: Number of questions to keep ready
+    """
+
+    def __init__(self, chunk_count: int, size: int = BANK_SIZE):
+        self.chunk_count = chunk_count
+        self.size = size
+        self.order = coverage_order(chunk_count)
+        self.cursor = 0
+        self.generated = 0
+        self.error: Optional[str] = None
+        self._questions: Deque[Dict] = deque()
+        self._init_runtime()
+
+    def _init_runtime(self) -> None:
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        # True from fill() until the worker has exited
+        self._filling = False
+
+    def __getstate__(self) -> Dict:
+        with self._lock:
+            state = self.__dict__.copy()
+            state['_questions'] = deque(self._questions)
+        for key in ('_lock', '_ready', '_filling'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._init_runtime()
+
+    @property
+    def building(self) -> bool:
+        return self._filling
+
+    def fill(self, index: ChunkIndex, retriever=None, top_k: int = TOP_K) -> None:
+        """Start generating questions in the background until size are ready"""
+        with self._lock:
+            if self.building or not self.order or len(self._questions) >= self.size:
+                return
+            self.error = None
+            self._filling = True
+        _executor.submit(self._run_fill, index, retriever, top_k)
+
+    def _run_fill(self, index: ChunkIndex, retriever, top_k: int) -> None:
+        try:
+            self._fill(index, retriever, top_k)
+        finally:
+            # Wake draw() however the worker exits, even if it added no questions
+            with self._ready:
+                self._filling = False
+                self._ready.notify_all()
+
+    def _fill(self, index: ChunkIndex, retriever, top_k: int) -> None:
+        processed = 0
+        # At most one pass over the document per fill, in case chunks yield no questions
+        while processed < len(self.order):
+            with self._lock:
+                if len(self._questions) >= self.size:
+                    return
+                if self.cursor >= len(self.order):
+                    self.cursor = 0
+                chunk_ids = self.order[self.cursor:self.cursor + FILL_BATCH]
+            try:
+                questions = questions_for_chunks(index, chunk_ids, retriever, top_k)
+            except Exception as e:
+                print(f"Error building question bank: {e}")
+                with self._lock:
+                    self.error = str(e)
+                return
+            with self._ready:
+                self.cursor += len(chunk_ids)
+                self.generated += len(chunk_ids)
+                processed += len(chunk_ids)
+                self._questions.extend(questions)
+                self._ready.notify_all()
+
+    def draw(self, count: int, index: Optional[ChunkIndex] = None, retriever=None,
+             timeout: float = 0) -> List[Dict]:
+        """
+        Take up to count ready questions, waiting up to timeout seconds for them
+
+        If index is given and the bank is running low afterwards, a refill is started.
+        """
+        with self._ready:
+            if timeout > 0:
+                self._ready.wait_for(
+                    lambda: len(self._questions) >= count or self.error or not self.building,
+                    timeout=timeout
+                )
+            drawn = [self._questions.popleft() for _ in range(min(count, len(self._questions)))]
+            remaining = len(self._questions)
+        if index is not None and remaining < REFILL_BELOW:
+            self.fill(index, retriever)
+        return drawn
+
+    def status(self) -> Dict:
+        """Ready questions, chunks covered so far and the last error"""
+        with self._lock:
+            return {
+                'ready': len(self._questions),
+                'size': self.size,
+                'building': self.building,
+                'covered': min(self.generated, self.chunk_count),
+                'chunks': self.chunk_count,
+                'error': self.error
+            }
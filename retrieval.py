@@ -0,0 +1,265 @@
+from collections import Counter
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+import heapq
+import math
+import re
+import numpy as np
+from chunking import ChunkIndex
+
+TOP_K = 3
+MIN_SCORE = 0.0
+
+_TERM_RE = re.compile(r'\w+')
+
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how i in is it its of on or
+that the their there these this to was were what when where which who why will with
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased word terms with stopwords removed"""
+    return [t for t in _TERM_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the chunks of a ChunkIndex.
+
+    The inverted index maps each term to a postings list of (chunk id, term
+    frequency), so a query only touches the chunks that share a term with it.
+
+    Args:
+        chunk_index: Chunks to index
+        k1: Term frequency saturation
+        b: Chunk length normalization
+    """
+
+    def __init__(self, chunk_index: ChunkIndex, k1: float = 1.5, b: float = 0.75):
+        self.chunk_index = chunk_index
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.lengths: List[int] = []
+
+        for chunk_id in range(len(chunk_index)):
+            terms = Counter(tokenize(chunk_index.chunk_text(chunk_id)))
+            self.lengths.append(sum(terms.values()))
+            for term, freq in terms.items():
+                self.postings.setdefault(term, []).append((chunk_id, freq))
+
+        self.avg_length = sum(self.lengths) / max(1, len(self.lengths))
+
+    @classmethod
+    def from_postings(cls, chunk_index: ChunkIndex, postings: Mapping[str, List[Tuple[int, int]]],
+                      lengths: Sequence[int], k1: float = 1.5, b: float = 0.75) -> 'BM25Index':
+        """A BM25Index over a prebuilt inverted index, e.g. one loaded from disk"""
+        index = cls.__new__(cls)
+        index.chunk_index = chunk_index
+        index.k1 = k1
+        index.b = b
+        index.postings = postings
+        index.lengths = lengths
+        index.avg_length = float(np.sum(lengths)) / max(1, len(lengths))
+        return index
+
+    def document_frequencies(self) -> Dict[str, int]:
+        """Number of chunks containing each term"""
+        frequencies = getattr(self.postings, 'frequencies', None)
+        if frequencies is not None:
+            return frequencies()
+        return {term: len(postings) for term, postings in self.postings.items()}
+
+    def idf(self, term: str) -> float:
+        df = len(self.postings.get(term, ()))
+        n = len(self.lengths)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = TOP_K, min_score: float = MIN_SCORE,
+               idf: Optional[Callable[[str], float]] = None) -> List[Tuple[int, float]]:
+        """
+        Score chunks against a query
+
+        Args:
+            idf: Term weights to use instead of this index's own, e.g. ones computed
+                over a whole library so scores are comparable between documents
+
+        Returns:
+            Up to top_k (chunk id, score) pairs with score above min_score, best first
+        """
+        idf_fn = idf or self.idf
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = idf_fn(term)
+            for chunk_id, freq in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[chunk_id] / self.avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+
+        best = heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+        return [(chunk_id, score) for chunk_id, score in best if score > min_score]
+
+
+def retrieve_chunks(retriever, query: str, top_k: int = TOP_K,
+                    min_score: float = MIN_SCORE) -> Optional[List[int]]:
+    """
+    Chunk ids worth running the QA model on, in document order.
+
+    Returns None when the retriever finds nothing, so callers can fall back to
+    scanning the whole document instead of answering from no context.
+    """
+    hits = retriever.search(query, top_k=top_k, min_score=min_score)
+    if not hits:
+        return None
+    return sorted(chunk_id for chunk_id, _ in hits)
+
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_DTYPES = ('float32', 'float16', 'int8')
+
+
+class TransformerEmbedder:
+    """
+    Mean-pooled sentence embeddings from a Hugging Face encoder.
+
+    The model is loaded by load() or on the first call.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, batch_size: int = 32, max_length: int = 256):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.tokenizer = None
+        self.model = None
+
+    def load(self):
+        from transformers import AutoModel, AutoTokenizer
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        self.model = AutoModel.from_pretrained(self.model_name)
+        self.model.eval()
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        import torch
+        if self.model is None:
+            self.load()
+        vectors = []
+        with torch.no_grad():
+            for b in range(0, len(texts), self.batch_size):
+                encoded = self.tokenizer(
+                    texts[b:b + self.batch_size],
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                    return_tensors='pt'
+                )
+                hidden = self.model(**encoded).last_hidden_state
+                mask = encoded['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+                pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+                vectors.append(pooled.numpy().astype(np.float32))
+        if not vectors:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.concatenate(vectors)
+
+
+def default_embedder() -> TransformerEmbedder:
+    """The embedder shared through the model registry"""
+    from model_registry import registry
+    return registry.get('embedder')
+
+
+class EmbeddingIndex:
+    """
+    Dense semantic retrieval over the chunks of a ChunkIndex.
+
+    Chunk vectors are L2-normalized and kept in one contiguous matrix, so a
+    query is scored against every chunk with a single matrix-vector product.
+    float16 halves the memory of the default float32 matrix; int8 quarters it,
+    storing one float32 scale per row.
+
+    Args:
+        chunk_index: Chunks to embed
+        embed_fn: Maps a list of texts to a (n, dim) array (defaults to the registry's shared embedder)
+        dtype: Storage type of the matrix: 'float32', 'float16' or 'int8'
+    """
+
+    _SCORE_BLOCK = 4096
+
+    def __init__(self, chunk_index: ChunkIndex, embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None,
+                 dtype: str = 'float32'):
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        self.chunk_index = chunk_index
+        self.embed_fn = embed_fn
+        self.dtype = dtype
+        self.scales: Optional[np.ndarray] = None
+
+        texts = [chunk_index.chunk_text(i) for i in range(len(chunk_index))]
+        vectors = self._normalize(self._embed(texts)) if texts else np.zeros((0, 0), dtype=np.float32)
+
+        if dtype == 'int8':
+            peak = np.abs(vectors).max(axis=1) if len(vectors) else np.zeros(0, dtype=np.float32)
+            self.scales = np.where(peak > 0, peak / 127.0, 1.0).astype(np.float32)
+            vectors = np.rint(vectors / self.scales[:, None]).astype(np.int8)
+        elif dtype == 'float16':
+            vectors = vectors.astype(np.float16)
+        self.vectors = np.ascontiguousarray(vectors)
+
+    @classmethod
+    def from_vectors(cls, chunk_index: ChunkIndex, vectors: np.ndarray, scales: Optional[np.ndarray] = None,
+                     embed_fn: Optional[Callable[[List[str]], np.ndarray]] = None) -> 'EmbeddingIndex':
+        """An EmbeddingIndex over stored chunk vectors (used as is, so memory maps stay zero-copy)"""
+        index = cls.__new__(cls)
+        index.chunk_index = chunk_index
+        index.embed_fn = embed_fn
+        index.dtype = vectors.dtype.name if scales is None else 'int8'
+        index.scales = scales
+        index.vectors = vectors
+        return index
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        # Resolved per call so pickled indexes reattach to the shared embedder lazily
+        embed_fn = self.embed_fn or default_embedder()
+        return np.asarray(embed_fn(texts), dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def scores(self, query: str) -> np.ndarray:
+        """Cosine similarity of the query with every chunk"""
+        if not len(self.vectors):
+            return np.zeros(0, dtype=np.float32)
+        query_vector = self._normalize(self._embed([query])[0])
+        scores = np.empty(len(self.vectors), dtype=np.float32)
+        # Score in blocks so reduced-precision matrices are never upcast in full
+        for b in range(0, len(self.vectors), self._SCORE_BLOCK):
+            block = self.vectors[b:b + self._SCORE_BLOCK].astype(np.float32, copy=False)
+            scores[b:b + len(block)] = block @ query_vector
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def search(self, query: str, top_k: int = TOP_K, min_score: float = MIN_SCORE) -> List[Tuple[int, float]]:
+        """
+        Score chunks against a query
+
+        Returns:
+            Up to top_k (chunk id, score) pairs with score above min_score, best first
+        """
+        scores = self.scores(query)
+        if not len(scores):
+            return []
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(i), float(scores[i])) for i in best if scores[i] > min_score]
+
+
+# Retrieval methods by the key they are requested and stored under
+RETRIEVERS = {
+    'bm25': BM25Index,
+    'embeddings': EmbeddingIndex
+}
@@ -1,16 +1,128 @@
-from transformers import pipeline
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import hashlib
+import threading
+from chunking import ChunkIndex
+from model_registry import registry
+from tracing import span
 
-# Load Hugging Face summarization pipeline
-summarizer = pipeline("summarization", model="facebook/bart-large-cnn")
+# BART reads at most 1024 tokens; chunks are measured with the approximate
+# token count of chunking.approx_token_count, so leave some headroom
+SUMMARY_CHUNK_TOKENS = 700
+CHUNK_SUMMARY_LENGTH = 120
+SUMMARY_BATCH_SIZE = 4
+SUMMARY_WORKERS = 1
+MAX_CACHED_DOCUMENTS = 32
 
-def generate_summary(text):
-    # Limit input size
-    limited_text = text[:3000]
+# Intermediate chunk summaries per document, keyed by document hash
+_chunk_summaries: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+_cache_lock = threading.Lock()
 
-    # Generate summary
-    summary = summarizer(limited_text, max_length=150, min_length=50, do_sample=False)
 
-    return summary[0]["summary_text"]
+def _document_cache(doc_key: str) -> Dict[str, str]:
+    with _cache_lock:
+        cache = _chunk_summaries.pop(doc_key, None)
+        if cache is None:
+            cache = {}
+        _chunk_summaries[doc_key] = cache
+        while len(_chunk_summaries) > MAX_CACHED_DOCUMENTS:
+            _chunk_summaries.popitem(last=False)
+        return cache
+
+
+def _summary_key(text: str, max_length: int, min_length: int) -> str:
+    return hashlib.sha1(f"{max_length}:{min_length}:{text}".encode('utf-8')).hexdigest()
+
+
+def _summarize_batch(texts: List[str], max_length: int, min_length: int) -> List[str]:
+    with span("summary.forward"):
+        outputs = registry.get('summarizer')(
+            texts,
+            max_length=max_length,
+            min_length=min_length,
+            do_sample=False,
+            truncation=True,
+            batch_size=len(texts)
+        )
+    return [output['summary_text'] for output in outputs]
+
+
+def summarize_chunks(texts: List[str], max_length: int, min_length: int, cache: Dict[str, str],
+                     batch_size: int = SUMMARY_BATCH_SIZE, workers: int = SUMMARY_WORKERS) -> List[str]:
+    """
+    Summarize texts in batches, skipping any whose summary is already cached
+
+    Args:
+        texts: Texts to summarize
+        max_length: Maximum summary length in tokens
+        min_length: Minimum summary length in tokens
+        cache: Summaries by _summary_key, updated in place
+        batch_size: Texts per summarizer call
+        workers: Batches summarized concurrently
+    """
+    keys = [_summary_key(text, max_length, min_length) for text in texts]
+    pending = list({key: text for key, text in zip(keys, texts) if key not in cache}.items())
+    batches = [pending[b:b + batch_size] for b in range(0, len(pending), batch_size)]
+
+    def run(batch):
+        summaries = _summarize_batch([text for _, text in batch], max_length, min_length)
+        for (key, _), summary in zip(batch, summaries):
+            cache[key] = summary
+
+    if workers > 1 and len(batches) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(run, batches))
+    else:
+        for batch in batches:
+            run(batch)
+
+    return [cache[key] for key in keys]
+
+
+def generate_summary(text: str, max_length: int = 150, min_length: int = 50,
+                     chunk_tokens: int = SUMMARY_CHUNK_TOKENS, batch_size: int = SUMMARY_BATCH_SIZE,
+                     workers: int = SUMMARY_WORKERS, doc_key: Optional[str] = None) -> str:
+    """
+    Summarize a whole document with map-reduce
+
+    The text is split into chunks that fit the model, the chunks are summarized
+    in batches, and the concatenated chunk summaries are chunked and summarized
+    again until they fit in a single chunk, which gets the final summary.
+
+    Args:
+        text: Document text
+        max_length: Maximum length of the final summary in tokens
+        min_length: Minimum length of the final summary in tokens
+        chunk_tokens: Approximate token budget of a chunk
+        batch_size: Chunks per summarizer call
+        workers: Batches summarized concurrently
+        doc_key: Key of the per-document cache of chunk summaries (defaults to a hash of the text)
+    """
+    if not text.strip():
+        return ""
+    cache = _document_cache(doc_key or hashlib.sha256(text.encode('utf-8')).hexdigest())
+
+    current = text
+    while True:
+        index = ChunkIndex(current, chunk_size=chunk_tokens, overlap=0, unit='tokens')
+        if len(index) <= 1:
+            break
+        chunks = [index.chunk_text(i) for i in range(len(index))]
+        summaries = summarize_chunks(
+            chunks,
+            max_length=CHUNK_SUMMARY_LENGTH,
+            min_length=min(30, CHUNK_SUMMARY_LENGTH),
+            cache=cache,
+            batch_size=batch_size,
+            workers=workers
+        )
+        reduced = " ".join(summaries)
+        if len(reduced) >= len(current):
+            break
+        current = reduced
+
+    return summarize_chunks([current], max_length, min_length, cache)[0]
 
 # (Optional: keep this test block if you want to run this file independently)
 # if __name__ == "__main__":
@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, math.inf)
+METRIC_NAME = "research_assistant_stage_seconds"
+TRACE_LOG = os.environ.get("TRACE_LOG")
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Span:
+    """Handle yielded by Tracer.span; seconds is set when the block exits"""
+
+    __slots__ = ('name', 'seconds')
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds = 0.0
+
+
+class Tracer:
+    """
+    Named timing spans with per-stage histograms.
+
+    ``with tracer.span("qa.inference"):`` times a stage. Every span is added to
+    the stage's histogram (rendered in Prometheus text format by
+    prometheus_text), appended as a JSON line to log_path if one is set, and
+    collected into the calling thread's trace if trace() is active, which is
+    how the app shows the stages of the last question.
+
+    Args:
+        log_path: File receiving one JSON object per span (None to disable)
+    """
+
+    def __init__(self, log_path: Optional[str] = TRACE_LOG):
+        self.log_path = log_path
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[Span]:
+        handle = Span(name)
+        start = time.perf_counter()
+        try:
+            yield handle
+        finally:
+            handle.seconds = time.perf_counter() - start
+            self.record(name, handle.seconds)
+
+    def record(self, name: str, seconds: float) -> None:
+        """Record a stage duration measured elsewhere (e.g. reported by Ollama)"""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+            if self.log_path:
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({'stage': name, 'seconds': seconds, 'time': time.time()}) + "\n")
+        spans = getattr(self._local, 'spans', None)
+        if spans is not None:
+            spans.append((name, seconds))
+
+    @contextmanager
+    def trace(self) -> Iterator[List[Tuple[str, float]]]:
+        """Collect the (stage, seconds) spans recorded by this thread inside the block"""
+        previous = getattr(self._local, 'spans', None)
+        spans: List[Tuple[str, float]] = []
+        self._local.spans = spans
+        try:
+            yield spans
+        finally:
+            self._local.spans = previous
+            if previous is not None:
+                previous.extend(spans)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Count, total and mean seconds of every stage"""
+        with self._lock:
+            return {
+                name: {'count': h.count, 'sum': h.sum, 'mean': h.sum / h.count if h.count else 0.0}
+                for name, h in sorted(self._histograms.items())
+            }
+
+    def prometheus_text(self) -> str:
+        lines = [
+            f"# HELP {METRIC_NAME} Time spent in each pipeline stage.",
+            f"# TYPE {METRIC_NAME} histogram"
+        ]
+        with self._lock:
+            for name, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if math.isinf(bound) else repr(bound)
+                    lines.append(f'{METRIC_NAME}_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{METRIC_NAME}_sum{{stage="{name}"}} {histogram.sum}')
+                lines.append(f'{METRIC_NAME}_count{{stage="{name}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+tracer = Tracer()
+span = tracer.span
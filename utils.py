@@ -15,63 +15,227 @@
 
 
 import PyPDF2
-from typing import Union
-from transformers import pipeline
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+import io
+import os
 import re
+import summarizer
 
-def extract_text_from_file(file) -> str:
-    """Extract text from PDF or TXT file"""
+PDF_WORKERS = max(1, min(4, (os.cpu_count() or 1) - 1))
+PAGES_PER_TASK = 8
+
+_KEPT = r'\w.,;:!?\'"-'
+# Everything clean_text changes: runs of two or more non-kept characters, or one
+# that is not a plain space. Single spaces between words are left alone, so
+# they are never matched.
+_IRREGULAR_RE = re.compile(rf'[^{_KEPT}]{{2,}}|[^ {_KEPT}]')
+_WHITESPACE_RE = re.compile(r'\s+')
+_SPECIAL_RE = re.compile(rf'[^\s{_KEPT}]+')
+
+# (cleaned position, original offset - cleaned position) from that position on
+Breakpoints = List[Tuple[int, int]]
+
+class OffsetMap:
+    """
+    Maps positions in cleaned document text back to (page, offset in the page's extracted text).
+
+    Cleaning only replaces whitespace with single spaces and deletes characters,
+    so within a stretch of text between two deletions cleaned and original
+    positions differ by a constant. Only the positions where that difference
+    changes are stored, with the page they fall on, in three int64 arrays.
+    """
+
+    def __init__(self):
+        self.starts = array('q')
+        self.deltas = array('q')
+        self.pages = array('q')
+
+    def add_page(self, page: int, base: int, breakpoints: Breakpoints) -> None:
+        """Add a page whose cleaned text starts at position base of the document"""
+        for start, shift in breakpoints:
+            self.starts.append(base + start)
+            self.deltas.append(shift - base)
+            self.pages.append(page)
+
+    @classmethod
+    def from_arrays(cls, starts, deltas, pages) -> 'OffsetMap':
+        """An OffsetMap over stored arrays (used as is, e.g. memory-mapped; pages cannot be added)"""
+        offsets = cls.__new__(cls)
+        offsets.starts = starts
+        offsets.deltas = deltas
+        offsets.pages = pages
+        return offsets
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def locate(self, position: int) -> Tuple[int, int]:
+        """(page index, offset in the page's extracted text) of a cleaned-text position"""
+        if not len(self.starts):
+            return 0, position
+        i = max(0, bisect_right(self.starts, position) - 1)
+        return int(self.pages[i]), position + int(self.deltas[i])
+
+    def page_numbers(self, start: int, end: int) -> List[int]:
+        """1-based numbers of the pages a cleaned-text span covers"""
+        first = self.locate(start)[0]
+        last = self.locate(max(start, end - 1))[0]
+        return list(range(first + 1, last + 2))
+
+def page_label(pages: List[int]) -> str:
+    """'p. 3' or 'pp. 3–4' for the page numbers of a span"""
+    if not pages:
+        return ""
+    if len(pages) == 1:
+        return f"p. {pages[0]}"
+    return f"pp. {pages[0]}–{pages[-1]}"
+
+class NamedBytesIO(io.BytesIO):
+    """In-memory upload with the .name extract_text_from_file dispatches on"""
+
+    def __init__(self, data: bytes, name: str):
+        super().__init__(data)
+        self.name = name
+
+def _read_bytes(file) -> bytes:
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    file.seek(0)
+    return file.read()
+
+# PDF being extracted by this worker process, parsed once by _open_pdf
+_worker_reader: Optional[PyPDF2.PdfReader] = None
+
+def _open_pdf(data: bytes) -> None:
+    """Parse the PDF once per worker process (the ProcessPoolExecutor initializer)"""
+    global _worker_reader
+    _worker_reader = PyPDF2.PdfReader(io.BytesIO(data))
+
+def _extract_page_range(start: int, stop: int) -> List[Tuple[str, Breakpoints]]:
+    """Extract and normalize pages [start, stop) of the worker's PDF (runs in a worker process)"""
+    return [normalize_text(_worker_reader.pages[i].extract_text() or "") for i in range(start, stop)]
+
+def iter_pdf_pages(file, workers: int = PDF_WORKERS,
+                   pages_per_task: int = PAGES_PER_TASK) -> Iterator[Tuple[int, int, str, Breakpoints]]:
+    """
+    Extract a PDF page by page, cleaning each page as it arrives
+    
+    Args:
+        file: PDF file object
+        workers: Worker processes for page extraction (1 extracts in-process)
+        pages_per_task: Pages handed to a worker at a time
+        
+    Yields:
+        (page number, page count, cleaned page text, its breakpoints from
+        normalize_text) in page order
+    """
+    data = _read_bytes(file)
+    reader = PyPDF2.PdfReader(io.BytesIO(data))
+    page_count = len(reader.pages)
+    
+    if workers <= 1 or page_count <= pages_per_task:
+        for i, page in enumerate(reader.pages):
+            yield (i, page_count) + normalize_text(page.extract_text() or "")
+        return
+    
+    # The bytes go to each worker once, not with every task
+    with ProcessPoolExecutor(max_workers=workers, initializer=_open_pdf, initargs=(data,)) as pool:
+        futures = [
+            pool.submit(_extract_page_range, start, min(start + pages_per_task, page_count))
+            for start in range(0, page_count, pages_per_task)
+        ]
+        page = 0
+        for future in futures:
+            for text, breakpoints in future.result():
+                yield page, page_count, text, breakpoints
+                page += 1
+
+def extract_text_with_offsets(file, progress_callback: Optional[Callable[[int, int], None]] = None,
+                              workers: int = PDF_WORKERS) -> Tuple[str, Optional[OffsetMap]]:
+    """
+    Extract text from PDF or TXT file, with the page of every position
+    
+    Args:
+        file: Uploaded file object
+        progress_callback: Called with (pages done, page count) as PDF pages are extracted
+        workers: Worker processes for PDF page extraction
+    
+    Returns:
+        The cleaned text (pages joined by a space) and its OffsetMap, None for a TXT file
+    """
     if file.name.endswith('.pdf'):
         try:
-            reader = PyPDF2.PdfReader(file)
-            text = "\n".join([page.extract_text() for page in reader.pages])
-            return clean_text(text)
+            offsets = OffsetMap()
+            pages = []
+            length = 0
+            for page, page_count, text, breakpoints in iter_pdf_pages(file, workers=workers):
+                if text:
+                    if pages:
+                        length += 1
+                    offsets.add_page(page, length, breakpoints)
+                    pages.append(text)
+                    length += len(text)
+                if progress_callback:
+                    progress_callback(page + 1, page_count)
+            return " ".join(pages), offsets
         except Exception as e:
             raise ValueError(f"PDF extraction error: {str(e)}")
     elif file.name.endswith('.txt'):
-        return clean_text(file.read().decode('utf-8'))
+        return clean_text(file.read().decode('utf-8')), None
     else:
         raise ValueError("Unsupported file format")
 
+def extract_text_from_file(file, progress_callback: Optional[Callable[[int, int], None]] = None,
+                           workers: int = PDF_WORKERS) -> str:
+    """Extract text from PDF or TXT file (see extract_text_with_offsets)"""
+    return extract_text_with_offsets(file, progress_callback, workers)[0]
+
+def normalize_text(text: str) -> Tuple[str, Breakpoints]:
+    """
+    Clean extracted text in one pass, recording where cleaned positions come from
+    
+    Whitespace runs become a single space and characters other than word
+    characters and basic punctuation are removed, as clean_text always did.
+    
+    Returns:
+        The cleaned text and its breakpoints: (cleaned position, shift) pairs
+        such that from that position on, original offset = position + shift
+    """
+    parts = []
+    breakpoints: Breakpoints = [(0, 0)]
+    last = 0
+    removed = 0
+    for match in _IRREGULAR_RE.finditer(text):
+        start, end = match.span()
+        run = match.group()
+        if run.isspace():
+            replacement = ' '
+        elif len(run) == 1:
+            replacement = ''
+        else:
+            replacement = _SPECIAL_RE.sub('', _WHITESPACE_RE.sub(' ', run))
+        parts.append(text[last:start])
+        parts.append(replacement)
+        if len(replacement) != end - start:
+            removed += end - start - len(replacement)
+            breakpoints.append((end - removed, removed))
+        last = end
+    parts.append(text[last:])
+    cleaned = ''.join(parts)
+    
+    stripped = cleaned.strip()
+    lead = len(cleaned) - len(cleaned.lstrip())
+    if lead:
+        breakpoints = [(max(0, start - lead), shift + lead) for start, shift in breakpoints]
+    return stripped, breakpoints
+
 def clean_text(text: str) -> str:
     """Clean extracted text"""
-    # Remove excessive whitespace
-    text = re.sub(r'\s+', ' ', text)
-    # Remove special characters except basic punctuation
-    text = re.sub(r'[^\w\s.,;:!?\'"-]', '', text)
-    return text.strip()
+    return normalize_text(text)[0]
 
 def generate_summary(text: str, max_length: int = 150) -> str:
     """Generate a concise summary of the text"""
-    summarizer = pipeline("summarization", model="facebook/bart-large-cnn")
-    
-    # Split text into chunks if too long
-    chunks = []
-    if len(text.split()) > 1024:
-        words = text.split()
-        chunks = [' '.join(words[i:i+800]) for i in range(0, len(words), 800)]
-    else:
-        chunks = [text]
-    
-    summaries = []
-    for chunk in chunks:
-        summary = summarizer(
-            chunk,
-            max_length=max_length,
-            min_length=30,
-            do_sample=False
-        )[0]['summary_text']
-        summaries.append(summary)
-    
-    # Combine summaries if needed
-    if len(summaries) > 1:
-        combined = ' '.join(summaries)
-        if len(combined.split()) > max_length:
-            return summarizer(
-                combined,
-                max_length=max_length,
-                min_length=30,
-                do_sample=False
-            )[0]['summary_text']
-        return combined
-    return summaries[0]
\ No newline at end of file
+    return summarizer.generate_summary(text, max_length=max_length, min_length=30)